@@ -0,0 +1,166 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+from flask import Response, stream_with_context
+
+from bd_app3 import User, Category, Topic, Post
+from config import CONFIG
+from pagination import KeysetPage, page_args
+
+
+def _users():
+    return User.query.with_entities(User.id, User.username, User.email, User.created_at,
+                                    User.topic_count, User.post_count)
+
+
+def _topics():
+    return Topic.query\
+        .join(Category, Topic.category_id == Category.id)\
+        .join(User, Topic.user_id == User.id)\
+        .with_entities(Topic.id, Topic.title, User.username, Category.name.label('category_name'),
+                       Topic.created_at, Topic.reply_count, Topic.content)
+
+
+def _posts():
+    return Post.query\
+        .join(Topic, Post.topic_id == Topic.id)\
+        .join(User, Post.user_id == User.id)\
+        .with_entities(Post.id, User.username, Topic.title.label('topic_name'),
+                       Post.created_at, Post.content)
+
+
+# Админские списки: выборка, сортировки (имя -> колонка ключа) и доступные фильтры.
+# Сортировки только по колонкам с индексом, иначе каждая страница - полный проход.
+LISTINGS = {
+    'users': {
+        'model': User,
+        'query': _users,
+        'sorts': {'created': User.created_at, 'username': User.username},
+        'author': User.username,
+        'category': None,
+    },
+    'topics': {
+        'model': Topic,
+        'query': _topics,
+        'sorts': {'created': Topic.created_at, 'replies': Topic.reply_count},
+        'author': User.username,
+        'category': Topic.category_id,
+    },
+    'posts': {
+        'model': Post,
+        'query': _posts,
+        'sorts': {'created': Post.created_at},
+        'author': User.username,
+        'category': Topic.category_id,
+    },
+}
+
+
+def _date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
+
+
+class AdminListing:
+    """Список в админке с фильтрами и сортировкой из параметров запроса.
+
+    Фильтры: author (имя пользователя), category (id), from / to (даты
+    YYYY-MM-DD, to включительно); sort - имя из LISTINGS, order - asc / desc.
+    Страницы - KeysetPage по ключу (колонка сортировки, id), выгрузка
+    идет той же выборкой, но целиком и потоком из курсора.
+    """
+
+    def __init__(self, name, args):
+        self.name = name
+        self.spec = LISTINGS[name]
+        self.args = args
+        self.sort = args.get('sort') if args.get('sort') in self.spec['sorts'] else 'created'
+        self.order = 'asc' if args.get('order') == 'asc' else 'desc'
+        self.author = args.get('author', '').strip()
+        self.category = args.get('category', type=int) if self.spec['category'] is not None else None
+        self.date_from = _date(args.get('from'))
+        self.date_to = _date(args.get('to'))
+
+    @property
+    def filters(self):
+        """Текущие параметры списка для ссылок пагинации и выгрузки"""
+        values = {
+            'sort': self.sort, 'order': self.order, 'author': self.author, 'category': self.category,
+            'from': self.date_from and self.date_from.strftime('%Y-%m-%d'),
+            'to': self.date_to and self.date_to.strftime('%Y-%m-%d'),
+        }
+        return {name: value for name, value in values.items() if value}
+
+    def query(self):
+        model = self.spec['model']
+        query = self.spec['query']()
+        if self.author:
+            query = query.filter(self.spec['author'] == self.author)
+        if self.category is not None:
+            query = query.filter(self.spec['category'] == self.category)
+        if self.date_from is not None:
+            query = query.filter(model.created_at >= self.date_from)
+        if self.date_to is not None:
+            query = query.filter(model.created_at < self.date_to + timedelta(days=1))
+        return query
+
+    def page(self):
+        return KeysetPage(self.query(), self.spec['model'], CONFIG.ADMIN_PER_PAGE, stream=True,
+                          order_by=(self.spec['sorts'][self.sort],), descending=self.order == 'desc',
+                          **page_args(self.args))
+
+    def rows(self):
+        """Все строки выборки в порядке списка, читаются из курсора порциями"""
+        column = self.spec['sorts'][self.sort]
+        model = self.spec['model']
+        if self.order == 'desc':
+            order = (column.desc(), model.id.desc())
+        else:
+            order = (column.asc(), model.id.asc())
+        return self.query().order_by(*order).yield_per(CONFIG.STREAM_YIELD_PER)
+
+    def export(self, format):
+        """Ответ с выгрузкой в CSV или JSON Lines; строки не накапливаются в памяти"""
+        if format == 'jsonl':
+            chunks, mimetype = self._jsonl(), 'application/x-ndjson'
+        else:
+            format, chunks, mimetype = 'csv', self._csv(), 'text/csv'
+        filename = f"{self.name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{format}"
+        return Response(stream_with_context(chunks), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+    def _csv(self):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        rows = self.rows()
+        writer.writerow([column['name'] for column in rows.column_descriptions])
+        for row in rows:
+            writer.writerow(row)
+            if buffer.tell() >= CONFIG.STREAM_BUFFER_SIZE:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    def _jsonl(self):
+        lines = []
+        size = 0
+        for row in self.rows():
+            line = json.dumps(row._asdict(), ensure_ascii=False, default=_json_value) + '\n'
+            lines.append(line)
+            size += len(line)
+            if size >= CONFIG.STREAM_BUFFER_SIZE:
+                yield ''.join(lines)
+                lines = []
+                size = 0
+        yield ''.join(lines)
+
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} не сериализуется в JSON')
@@ -1,6 +1,23 @@
+import os
 from flask import Flask, render_template, request, redirect, url_for, flash, session
 from bd_app3 import *
-from datetime import datetime
+from sqlalchemy.orm import contains_eager, joinedload
+from pagination import KeysetPage, page_args
+from search import search as search_forum
+from query_stats import QueryCounter
+from write_queue import WriteQueue
+from cache import QueryCache
+from page_cache import PageCache
+from assets import Assets
+from compression import Compression
+from streaming import stream_page
+from admin_listing import AdminListing
+from jobs import JobRunner
+from metrics import Metrics
+from slow_queries import SlowQueryLog
+from profiler import Profiler
+from tracing import Tracer
+from conditional import ConditionalGet, topic_validator, category_validator, profile_validator
 
 from config import CONFIG
 
@@ -8,6 +25,89 @@ from config import CONFIG
 app = Flask(__name__)
 app.config['SECRET_KEY'] = CONFIG.SECRET_KEY
 database = DataBase(app)
+query_counter = QueryCounter(app)
+write_queue = WriteQueue(app)
+query_cache = QueryCache(app)
+page_cache = PageCache(app)
+conditional = ConditionalGet(app)
+assets = Assets(app)
+compression = Compression(app)
+jobs = JobRunner(app)
+metrics = Metrics(app)
+slow_queries = SlowQueryLog(app)
+profiler = Profiler(app)
+tracer = Tracer(app)
+
+
+def invalidate_after_bulk_delete():
+    # delete_topic / delete_category удаляют сообщения порциями в обход ORM-событий
+    query_cache.invalidate('posts', 'topics', 'categories', 'users', 'forum_stats')
+    page_cache.invalidate('*')
+
+
+# Фоновые задачи (jobs.py). Задачи, доступные для запуска из админки, - в MAINTENANCE_JOBS
+
+@jobs.task('delete_category')
+def delete_category_job(category_id):
+    posts = delete_category(category_id)
+    invalidate_after_bulk_delete()
+    return {'posts': posts}
+
+
+@jobs.task('rebuild_counters')
+def rebuild_counters_job():
+    rebuild_counters()
+    invalidate_after_bulk_delete()
+
+
+@jobs.task('rebuild_stats')
+def rebuild_stats_job():
+    rebuild_stats()
+    invalidate_after_bulk_delete()
+
+
+@jobs.task('rebuild_search')
+def rebuild_search_job():
+    rebuild_search_index()
+
+
+@metrics.collector
+def cache_metrics():
+    caches = {'query': query_cache.stats(), 'page': page_cache.stats()}
+    def by_cache(field):
+        return [((('cache', name),), stats[field]) for name, stats in caches.items()]
+    return [
+        ('forum_cache_hits_total', 'counter', 'Попадания в кэши', by_cache('hits')),
+        ('forum_cache_misses_total', 'counter', 'Промахи кэшей', by_cache('misses')),
+        ('forum_cache_hit_ratio', 'gauge', 'Доля попаданий', by_cache('hit_ratio')),
+        ('forum_cache_entries', 'gauge', 'Записей в кэше', by_cache('entries')),
+    ]
+
+
+@metrics.collector
+def compression_metrics():
+    stats = compression.stats()
+    return [
+        ('forum_compressed_responses_total', 'counter', 'Сжатые ответы', [((), stats['responses'])]),
+        ('forum_compression_bytes_total', 'counter', 'Байты до и после сжатия',
+         [((('stage', 'in'),), stats['bytes_in']), ((('stage', 'out'),), stats['bytes_out'])]),
+        ('forum_compression_cpu_seconds_total', 'counter', 'Процессорное время на сжатие',
+         [((), stats['cpu_ms'] / 1000)]),
+    ]
+
+
+@metrics.collector
+def job_metrics():
+    counts = jobs.stats()
+    return [('forum_jobs', 'gauge', 'Фоновые задачи по статусам',
+             [((('status', status),), counts.get(status, 0)) for status in ('queued', 'running', 'done', 'failed')])]
+
+
+MAINTENANCE_JOBS = {
+    'rebuild_counters': 'Пересчитать счетчики',
+    'rebuild_stats': 'Пересчитать статистику',
+    'rebuild_search': 'Перестроить поисковый индекс',
+}
 
 #  Протестить на баги
 # ! Сделать рефакторинг кода и вынести все по отдельным функциям и классам
@@ -16,14 +116,8 @@ database = DataBase(app)
 @app.route('/', methods=['GET', 'POST'])
 def index():
     
-    categories = Category.query.all()
-    for categories_id in categories:
-        categories_id.topic_count = len(Topic.query.filter(Topic.category_id==categories_id.id).all())
-        post_all = Topic.query.filter(Topic.category_id==categories_id.id).all()
-        categories_id.post_count = 0
-        for post_id in post_all:
-            number = len(Post.query.filter(Post.topic_id==post_id.id).all())
-            categories_id.post_count = categories_id.post_count + number
+    # Счетчики тем и сообщений хранятся в самой категории
+    categories = query_cache.all(Category)
     return render_template('index.html', categories=categories)
 
 
@@ -36,7 +130,7 @@ def profile(username=None):
             flash('Для просмотра профиля необходимо войти в систему')
             return redirect(url_for('login'))
         user_id = session['user_id']
-        user = User.query.get(user_id)
+        user = query_cache.get(User, user_id)
         if not user:
             flash('Пользователь не найден')
             return redirect(url_for('login'))
@@ -47,10 +141,12 @@ def profile(username=None):
             flash('Пользователь не найден')
             return redirect(url_for('index'))  # или куда-то еще
     
+    not_modified = conditional.check(*profile_validator(user))
+    if not_modified:
+        return not_modified
+    
     # Общая логика для обоих случаев
     user.is_online = session.get('online', False) if username is None else False
-    user.post_count = len(Post.query.filter(Post.user_id==user.id).all())
-    user.topic_count = len(Topic.query.filter(Topic.user_id==user.id).all())
     user.reputation = 10
     
     recent_posts = Post.query\
@@ -98,7 +194,7 @@ def login():
             session['username'] = user.username
             session['online'] = 'online'
             
-            admin = User.query.get(1)
+            admin = query_cache.get(User, 1)
             print(admin.username)
             print(user.username)
             if admin.username == session['username']:
@@ -150,54 +246,44 @@ def logout():
 
 @app.route('/about', methods=['GET', 'POST'])
 def about():
-    class stats:
-        users = len(User.query.all())
-        topics = len(Topic.query.all())
-        posts = len(Post.query.all())
-        last_post = Post.query\
-        .order_by(Post.created_at)\
-        .first()
-        if last_post is not None:
-            last_post = datetime.today().date()
-        
+    # Статистика хранится в одной строке forum_stats
+    stats = ForumStats.current()
     return render_template('about.html', stats=stats)
 
 @app.route('/category/<int:category_id>', methods=['GET', 'POST'])
 def category(category_id):
-    category = Category.query.get(category_id)
+    category = query_cache.get(Category, category_id)
     
-    topics = Topic.query.filter(Topic.category_id == category_id).all()
-    for topics_id in topics:
-        topics_id.reply_count = len(Post.query.filter(Post.topic_id==topics_id.id).all())
-    print(topics)
     if request.method == 'POST':
         action = request.form.get('action')
         if action == 'delete':
-            topic_id = request.form.get('topic_id')
-            delete_topic = Topic.query.get(topic_id)
-            if delete_topic:
-                db.session.delete(delete_topic)
-                db.session.commit()
+            topic_id = request.form.get('topic_id', type=int)
+            if topic_id is not None and db.session.get(Topic, topic_id):
+                delete_topic(topic_id)
+                invalidate_after_bulk_delete()
                 flash('Категория удалена')
         else:
             content = request.form['content']
             title = request.form['title']
 
             user_id = session['user_id']
-            topic = Topic(content=content, user_id=user_id, category_id=category_id,title=title)
-            db.session.add(topic)
-            db.session.commit()
+            write_queue.create(Topic, content=content, user_id=user_id, category_id=category_id, title=title)
             flash('Вы создали тему')
+            return redirect(url_for('category', category_id=category_id, page='last'))
+    if category is not None:
+        not_modified = conditional.check(*category_validator(category))
+        if not_modified:
+            return not_modified
+    # Автор подгружается тем же запросом, иначе шаблон делает по запросу на каждую тему
+    topics = Topic.query\
+            .options(joinedload(Topic.author))\
+            .filter(Topic.category_id == category_id)
+    topics = KeysetPage(topics, Topic, CONFIG.TOPICS_PER_PAGE, **page_args(request.args))
     return render_template('category.html',category=category,topics=topics)
 
 @app.route('/topic/<int:topic_id>', methods=['GET', 'POST'])
 def topic(topic_id):
-    topic = Topic.query.get(topic_id)
-    posts = Post.query\
-            .join(User, Post.user_id == User.id)\
-            .join(Topic, Post.topic_id == Topic.id)\
-            .add_columns(Post.id, Post.content, Post.created_at, User.username, Topic.title)\
-            .filter(Post.topic_id == topic_id)
+    topic = query_cache.get(Topic, topic_id, 'author', 'category')
     if request.method == 'POST':
         action = request.form.get('action')
         if action == 'delete':
@@ -210,26 +296,58 @@ def topic(topic_id):
         else:
             content = request.form['content']
             user_id = session['user_id']
-            post = Post(content=content, user_id=user_id, topic_id=topic_id)
-            db.session.add(post)
-            db.session.commit()
+            post_id = write_queue.create(Post, content=content, user_id=user_id, topic_id=topic_id)
             flash('Вы отправили сообщение')
-    return render_template('topic.html', topic=topic, posts=posts)
+            return redirect(url_for('topic', topic_id=topic_id, post=post_id, _anchor=f'post-{post_id}'))
+    if topic is not None:
+        not_modified = conditional.check(*topic_validator(topic))
+        if not_modified:
+            return not_modified
+    posts = Post.query\
+            .join(User, Post.user_id == User.id)\
+            .join(Topic, Post.topic_id == Topic.id)\
+            .add_columns(Post.id, Post.content, Post.created_at, User.username, User.post_count, Topic.title)\
+            .filter(Post.topic_id == topic_id)
+    # ?post=<id> открывает страницу, начинающуюся с этого сообщения
+    posts = KeysetPage(posts, Post, CONFIG.POSTS_PER_PAGE, stream=True,
+                       start=request.args.get('post', type=int), **page_args(request.args))
+    return stream_page('topic.html', topic=topic, posts=posts)
+
+@app.route('/search')
+def search():
+    q = request.args.get('q', '').strip()
+    category_id = request.args.get('category', type=int)
+    author = request.args.get('author', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    
+    results, has_next = search_forum(q, category_id=category_id, author=author or None,
+                                     page=page, per_page=CONFIG.SEARCH_PER_PAGE,
+                                     max_pages=CONFIG.SEARCH_MAX_PAGES, candidates=CONFIG.SEARCH_CANDIDATES)
+    categories = query_cache.all(Category)
+    return render_template('search.html', q=q, category_id=category_id, author=author,
+                           page=page, results=results, has_next=has_next, categories=categories)
         
 from flask import Flask, render_template, session, redirect, url_for
 from functools import wraps
 
+@profiler.access
+def is_admin():
+    """Текущий пользователь - администратор (пользователь с id 1)"""
+    if 'user_id' not in session:
+        return False
+    admin = query_cache.get(User, 1)
+    return admin is not None and admin.username == session.get('username')
+
+
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             print('Не зашел')
             return redirect(url_for('index'))
-        admin = User.query.get(1)
-        if admin.username == session['username']:
+        if is_admin():
             session['admin'] = True
         else:
-            print(admin)
             print('Не админ')
             return redirect(url_for('index'))
         # Проверка прав администратора (замените на свою логику)
@@ -241,84 +359,70 @@ def admin_required(f):
 @app.route('/admin')
 @admin_required
 def admin_dashboard():
+    forum_stats = ForumStats.current()
     class stats:
-        users = len(User.query.all())
-        user_limit = User.query.limit(3).all()
+        users = forum_stats.users
+        user_limit = User.query.order_by(User.id.desc()).limit(3).all()
+        
+        topics = forum_stats.topics
+        topics_limit = Topic.query\
+            .join(User, Topic.user_id == User.id)\
+            .options(contains_eager(Topic.author))\
+            .order_by(Topic.id.desc())\
+            .limit(3)\
+            .all()
         
-        topics = len(Topic.query.all())
-        topics_limit = Topic.query.join(User, Topic.user_id == User.id).limit(3).all()
+        posts = forum_stats.posts
+        last_post = forum_stats.last_post
         
-        posts = len(Post.query.all())
-        last_post = Post.query\
-        .order_by(Post.created_at)\
-        .first()
-        if last_post is not None:
-            last_post = datetime.today().date()
+        cache = query_cache.stats()
+        pages = page_cache.stats()
 
     return render_template('admin/admin_dashboard.html', stats=stats)
 
 @app.route('/admin/users')
 @admin_required
 def admin_users():
-    users = User.query.all()
-    for user in users:
-        user.post_count = len(Post.query.filter(Post.user_id==user.id).all())
-
-    return render_template('admin/admin_users.html', users=users)
+    listing = AdminListing('users', request.args)
+    return stream_page('admin/admin_users.html', listing=listing, users=listing.page())
 
 @app.route('/admin/topics')
 @admin_required
 def admin_topics():
-    topics = Topic.query\
-    .join(Category, Topic.category_id == Category.id)\
-    .join(User, Topic.user_id == User.id)\
-    .add_columns(Topic.id,
-                 
-        User.username,
-        Topic.title,       
-        Topic.content,     
-        Topic.created_at,
-        Topic.user_id, Category.name.label('category_name'))\
-    .all()
-
-    return render_template('admin/admin_topics.html', topics = topics)
+    listing = AdminListing('topics', request.args)
+    return stream_page('admin/admin_topics.html', listing=listing, topics=listing.page(),
+                       categories=query_cache.all(Category))
 
 @app.route('/admin/posts')
 @admin_required
 def admin_posts():
-    posts = Post.query\
-    .join(Topic, Post.topic_id == Topic.id)\
-    .join(User, Post.user_id == User.id)\
-    .add_columns(Post.id,
-                 
-        User.username,
-        Post.content,       
-        Post.created_at,
-        Topic.title.label('topic_name'))\
-    .all()
-    return render_template('admin/admin_posts.html', posts=posts)
+    listing = AdminListing('posts', request.args)
+    return stream_page('admin/admin_posts.html', listing=listing, posts=listing.page(),
+                       categories=query_cache.all(Category))
+
+@app.route('/admin/export/<any(users, topics, posts):name>')
+@admin_required
+def admin_export(name):
+    # Те же фильтры и сортировка, что и у списка, формат - ?format=csv|jsonl
+    return AdminListing(name, request.args).export(request.args.get('format', 'csv'))
 
 @app.route('/admin/categories', methods=['GET', 'POST'])
 @admin_required
 def admin_categories():
-    categories = Category.query.all()
-    for categories_id in categories:
-        categories_id.topic_count = len(Topic.query.filter(Topic.category_id==categories_id.id).all())
-        post_all = Topic.query.filter(Topic.category_id==categories_id.id).all()
-        categories_id.post_count = 0
-        for post_id in post_all:
-            number = len(Post.query.filter(Post.topic_id==post_id.id).all())
-            categories_id.post_count = categories_id.post_count + number
-
     if request.method == 'POST':
         action = request.form.get('action')
         if action == 'delete':
-            category_id = request.form.get('category_id')
-            delete_category = Category.query.get(category_id)
-            if delete_category:
-                db.session.delete(delete_category)
-                db.session.commit()
-                flash('Категория удалена')
+            category_id = request.form.get('category_id', type=int)
+            if category_id is not None and db.session.get(Category, category_id):
+                # Большая категория удаляется долго, поэтому в фоне (без исполнителей - сразу)
+                job_id = jobs.enqueue('delete_category', category_id=category_id)
+                status = db.session.get(Job, job_id).status
+                if status == 'done':
+                    flash(f'Категория удалена (задача #{job_id})')
+                elif status == 'failed' or not jobs.alive():
+                    flash(f'Категорию удалить не удалось (задача #{job_id}, подробности в разделе задач)', 'error')
+                else:
+                    flash(f'Категория удаляется (задача #{job_id})')
         else:
             name = request.form['name']
             description = request.form['description']
@@ -327,10 +431,75 @@ def admin_categories():
             db.session.add(category)
             db.session.commit()
             flash('Вы создали категорию')
+    categories = Category.query.all()
     return render_template('admin/admin_categories.html', categories=categories)
 
+
+@app.route('/admin/jobs', methods=['GET', 'POST'])
+@admin_required
+def admin_jobs():
+    if request.method == 'POST':
+        action = request.form.get('action')
+        if action == 'retry':
+            if jobs.retry(request.form.get('job_id', type=int)):
+                flash('Задача снова в очереди')
+        elif action in MAINTENANCE_JOBS:
+            job_id = jobs.enqueue(action)
+            flash(f'Задача #{job_id} поставлена в очередь')
+        return redirect(url_for('admin_jobs'))
+    recent = Job.query.order_by(Job.id.desc()).limit(CONFIG.ADMIN_PER_PAGE).all()
+    return render_template('admin/admin_jobs.html', jobs=recent, counts=jobs.stats(),
+                           maintenance=MAINTENANCE_JOBS, workers_alive=not CONFIG.JOBS or jobs.alive())
+
+
+@app.route('/admin/slow-queries')
+@admin_required
+def admin_slow_queries():
+    return render_template('admin/admin_slow_queries.html', groups=slow_queries.top(),
+                           enabled=slow_queries.enabled, threshold=CONFIG.SLOW_QUERY_MS)
+
+
+@app.cli.command('rebuild-counters')
+def rebuild_counters_command():
+    """Пересчитать счетчики тем и сообщений"""
+    rebuild_counters()
+    print('Счетчики пересчитаны')
+
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Пересчитать общую статистику форума"""
+    rebuild_stats()
+    print('Статистика пересчитана')
+
+
+@app.cli.command('rebuild-search')
+def rebuild_search_command():
+    """Перестроить полнотекстовый индекс"""
+    rebuild_search_index()
+    print('Поисковый индекс перестроен')
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Собрать статику с хэшем в имени и сжатыми копиями"""
+    manifest = assets.build()
+    print(f'Собрано файлов: {len(manifest)}')
+
+
+@app.cli.command('jobs-worker')
+def jobs_worker_command():
+    """Выполнять фоновые задачи (для WSGI-серверов, которые не запускают исполнителей)"""
+    if not CONFIG.JOBS:
+        print('Фоновые задачи выключены (FORUM_JOBS=0)')
+        return
+    print(f'Исполнителей: {jobs.workers}, остановка - Ctrl+C')
+    jobs.start(wait=True)
+
     
 if __name__ == '__main__':
-
+    # С перезагрузчиком отладки код выполняется дважды: исполнители нужны только процессу, который обслуживает запросы
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        jobs.start()
     app.run(debug=True)
     
\ No newline at end of file
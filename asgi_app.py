@@ -0,0 +1,212 @@
+from a2wsgi import WSGIMiddleware
+from quart import Quart, abort, flash, make_response, redirect, render_template, request, session, url_for
+from quart.wrappers.response import DataBody
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import joinedload
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Rule
+
+import app3
+from bd_app3 import db, User, Category, Topic, Post, ForumStats, apply_sqlite_pragmas
+from compression import accepts_gzip
+from config import CONFIG
+from pagination import AsyncKeysetPage, page_args
+
+# Зависимости: pip install -r requirements-async.txt
+# Запуск: hypercorn asgi_app:application (или uvicorn asgi_app:application)
+
+async_app = Quart(__name__, static_folder=None)
+async_app.config['SECRET_KEY'] = CONFIG.SECRET_KEY
+# Та же база, что у синхронного приложения (относительный путь SQLite считается от instance/)
+with app3.app.app_context():
+    engine_url = db.engine.url.set(drivername=CONFIG.ASYNC_DATABASE_DRIVER)
+engine_options = {} if ':memory:' in CONFIG.SQLALCHEMY_DATABASE_URI else CONFIG.ENGINE_PROFILES[CONFIG.PROFILE]
+engine = create_async_engine(engine_url, **engine_options)
+if engine.dialect.name == 'sqlite':
+    event.listen(engine.sync_engine, 'connect',
+                 lambda connection, record: apply_sqlite_pragmas(connection, CONFIG.SQLITE_PRAGMAS))
+read_session = async_sessionmaker(engine, expire_on_commit=False)
+async_app.url_defaults(app3.assets._fingerprint)
+
+
+@async_app.before_serving
+async def start_jobs():
+    # Исполнители фоновых задач синхронного приложения работают в этом же процессе
+    app3.jobs.start()
+
+
+@async_app.after_serving
+async def close_engine():
+    await engine.dispose()
+
+
+@async_app.after_request
+async def compress(response):
+    # Сжатие синхронного приложения - WSGI-обертка, async-ответы сжимает та же логика здесь
+    # Ответы об ошибках Werkzeug и потоковые тела не трогаем: сжимается только готовое тело
+    if request.method == 'HEAD' or not isinstance(getattr(response, 'response', None), DataBody):
+        return response
+    data = app3.compression.compress(str(response.status_code), response.headers, await response.get_data(),
+                                     accepts_gzip(request.headers.get('Accept-Encoding', '')))
+    response.set_data(data)
+    return response
+
+
+# Условные GET с теми же ETag, что у синхронных представлений (conditional.py)
+
+async def last_row(db_session, model, condition):
+    return (await db_session.execute(select(model.created_at, model.id)
+                                     .where(condition)
+                                     .order_by(model.created_at.desc(), model.id.desc())
+                                     .limit(1))).first()
+
+
+async def conditional(parts, render):
+    """304, если версия клиента актуальна, иначе страница из render(); ETag в обоих случаях"""
+    if request.method != 'GET' or '_flashes' in session:
+        return await render()
+    etag = app3.conditional.etag(parts, session)
+    if request.if_none_match.contains_weak(etag):
+        response = await make_response('', 304)
+    else:
+        response = await make_response(await render())
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@async_app.route('/')
+async def index():
+    async with read_session() as db_session:
+        categories = (await db_session.scalars(select(Category))).all()
+    return await render_template('index.html', categories=categories)
+
+
+@async_app.route('/profile/')
+@async_app.route('/profile/<string:username>')
+async def profile(username=None):
+    async with read_session() as db_session:
+        if username is None:
+            if 'user_id' not in session:
+                await flash('Для просмотра профиля необходимо войти в систему')
+                return redirect(url_for('login'))
+            user = await db_session.get(User, session['user_id'])
+            if not user:
+                await flash('Пользователь не найден')
+                return redirect(url_for('login'))
+        else:
+            user = await db_session.scalar(select(User).where(User.username == username))
+            if not user:
+                await flash('Пользователь не найден')
+                return redirect(url_for('index'))
+
+        user.is_online = session.get('online', False) if username is None else False
+        user.reputation = 10
+
+        last = await last_row(db_session, Post, Post.user_id == user.id)
+        parts = ('profile', user.id, user.post_count, user.topic_count, tuple(last) if last else None)
+
+        async def render():
+            recent_posts = (await db_session.execute(
+                select(Post.id, Post.content, Post.created_at, Post.topic_id, Topic.title.label('topic_title'))
+                .join(Topic, Post.topic_id == Topic.id)
+                .where(Post.user_id == user.id)
+                .order_by(Post.created_at.desc())
+                .limit(5))).all()
+            return await render_template('profile.html', user=user, recent_posts=recent_posts)
+
+        return await conditional(parts, render)
+
+
+@async_app.route('/about')
+async def about():
+    async with read_session() as db_session:
+        stats = await db_session.get(ForumStats, 1)
+    return await render_template('about.html', stats=stats)
+
+
+@async_app.route('/category/<int:category_id>')
+async def category(category_id):
+    async with read_session() as db_session:
+        category = await db_session.get(Category, category_id)
+        if category is None:
+            abort(404)
+        last = await last_row(db_session, Topic, Topic.category_id == category_id)
+        parts = ('category', category.id, category.topic_count, category.post_count, tuple(last) if last else None)
+
+        async def render():
+            # Ленивой загрузки в async нет: все, что нужно шаблону, выбирается заранее
+            topics = select(Topic)\
+                .options(joinedload(Topic.author))\
+                .where(Topic.category_id == category_id)
+            topics = await AsyncKeysetPage(topics, Topic, CONFIG.TOPICS_PER_PAGE,
+                                           **page_args(request.args)).load(db_session)
+            return await render_template('category.html', category=category, topics=topics)
+
+        return await conditional(parts, render)
+
+
+@async_app.route('/topic/<int:topic_id>')
+async def topic(topic_id):
+    async with read_session() as db_session:
+        topic = await db_session.get(Topic, topic_id,
+                                     options=[joinedload(Topic.author), joinedload(Topic.category)])
+        if topic is None:
+            abort(404)
+        last = await last_row(db_session, Post, Post.topic_id == topic_id)
+        parts = ('topic', topic.id, topic.reply_count, tuple(last) if last else None)
+
+        async def render():
+            posts = select(Post.id, Post.content, Post.created_at, User.username, User.post_count, Topic.title)\
+                .join(User, Post.user_id == User.id)\
+                .join(Topic, Post.topic_id == Topic.id)\
+                .where(Post.topic_id == topic_id)
+            posts = await AsyncKeysetPage(posts, Post, CONFIG.POSTS_PER_PAGE,
+                                          start=request.args.get('post', type=int),
+                                          **page_args(request.args)).load(db_session)
+            return await render_template('topic.html', topic=topic, posts=posts)
+
+        return await conditional(parts, render)
+
+
+# Ссылки на остальные маршруты строятся как обычно, но обслуживает их синхронное приложение
+for rule in app3.app.url_map.iter_rules():
+    if rule.endpoint not in async_app.view_functions:
+        async_app.url_map.add(Rule(rule.rule, endpoint=rule.endpoint, methods=rule.methods, build_only=True))
+
+
+class Dispatcher:
+    """ASGI-приложение форума.
+
+    GET и HEAD страниц чтения (index, category, topic, profile, about) идут в
+    async_app: async-представления поверх AsyncSession и aiosqlite, ожидание
+    базы не занимает поток. Эти страницы, как и синхронные, отвечают 304 по
+    ETag и сжимаются gzip; несуществующая тема или категория - 404. Все остальное (формы, вход, админка, поиск,
+    статика, /metrics) обслуживает прежнее синхронное приложение app3 в пуле
+    из ASGI_WSGI_THREADS потоков, с его кэшами, сжатием и метриками.
+    """
+
+    def __init__(self, async_app, sync_app):
+        self.async_app = async_app
+        self.sync_app = WSGIMiddleware(sync_app, workers=CONFIG.ASGI_WSGI_THREADS)
+        self.routes = async_app.url_map.bind('localhost')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or self._is_async(scope):
+            await self.async_app(scope, receive, send)
+        else:
+            await self.sync_app(scope, receive, send)
+
+    def _is_async(self, scope):
+        if scope['method'] not in ('GET', 'HEAD'):
+            return False
+        try:
+            # Правила только для построения ссылок не совпадают ни с одним путем
+            self.routes.match(scope['path'], method=scope['method'])
+        except HTTPException:
+            return False
+        return True
+
+
+application = Dispatcher(async_app, app3.app)
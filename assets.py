@@ -0,0 +1,111 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен, без него собираются только .gz
+    brotli = None
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+COMPRESSIBLE = ('.css', '.js', '.svg', '.html', '.txt', '.json')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def build(static_folder):
+    """Копирует статику в static/dist с хэшем содержимого в имени и сжатыми версиями рядом.
+
+    Возвращает манифест {исходное имя: имя в dist}.
+    """
+    dist = os.path.join(static_folder, DIST)
+    if os.path.isdir(dist):
+        shutil.rmtree(dist)
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = [name for name in dirs if os.path.join(root, name) != dist]
+        for name in files:
+            path = os.path.join(root, name)
+            source = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                data = f.read()
+            stem, ext = os.path.splitext(source)
+            target = f'{DIST}/{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+            target_path = os.path.join(static_folder, target)
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            with open(target_path, 'wb') as f:
+                f.write(data)
+            if ext in COMPRESSIBLE:
+                _write_compressed(target_path + '.gz', data, gzip.compress(data, 9, mtime=0))
+                if brotli is not None:
+                    _write_compressed(target_path + '.br', data, brotli.compress(data, quality=11))
+            manifest[source] = target
+    with open(os.path.join(dist, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    return manifest
+
+
+def _write_compressed(path, data, compressed):
+    # Сжатая версия нужна, только если она действительно меньше
+    if len(compressed) < len(data):
+        with open(path, 'wb') as f:
+            f.write(compressed)
+
+
+class Assets:
+    """Статика с отпечатком в имени файла.
+
+    url_for('static', filename='css/styles.css') отдает собранное имя из
+    манифеста (flask --app app3 build-assets). Такие файлы раздаются с
+    Cache-Control immutable и, если клиент умеет, в заранее сжатом виде
+    (.br, затем .gz). Без сборки все работает как раньше.
+    """
+
+    def __init__(self, app=None):
+        self.manifest = {}
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        self.load()
+        app.url_defaults(self._fingerprint)
+        self._send_static = app.view_functions['static']
+        app.view_functions['static'] = self._static
+
+    def load(self):
+        path = os.path.join(self.static_folder, DIST, MANIFEST)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {}
+
+    def build(self):
+        self.manifest = build(self.static_folder)
+        return self.manifest
+
+    def _fingerprint(self, endpoint, values):
+        if endpoint == 'static' and values.get('filename') in self.manifest:
+            values['filename'] = self.manifest[values['filename']]
+
+    def _static(self, filename):
+        if not filename.startswith(DIST + '/'):
+            return self._send_static(filename=filename)
+        accepted = request.accept_encodings
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if accepted[encoding] and os.path.exists(os.path.join(self.static_folder, filename + suffix)):
+                response = send_from_directory(self.static_folder, filename + suffix,
+                                               mimetype=mimetypes.guess_type(filename)[0], max_age=31536000)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(self.static_folder, filename, max_age=31536000)
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.vary.add('Accept-Encoding')
+        return response
@@ -1,4 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func, inspect, literal, select, text
+from sqlalchemy.schema import CreateTable
 from config import CONFIG
 from datetime import datetime
 db = SQLAlchemy()
@@ -6,13 +8,20 @@ db = SQLAlchemy()
 
 class User(db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ix_users_created', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password = db.Column(db.String(120), nullable=False)
     admin = db.Column(db.Integer, default=0)
-    created_at = db.Column(db.DateTime, default=datetime.now().replace(microsecond=0))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now().replace(microsecond=0))
+    
+    # Счетчики (обновляются событиями ниже)
+    topic_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # Relationships
     categories = db.relationship('Category', backref='author', lazy=True)
@@ -29,44 +38,390 @@ class Category(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=datetime.now().replace(microsecond=0))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now().replace(microsecond=0))
+    
+    # Счетчики (обновляются событиями ниже)
+    topic_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # Relationships
-    topics = db.relationship('Topic', backref='category', lazy=True, cascade='all, delete-orphan')
+    # Темы удаляет ON DELETE CASCADE в базе, ORM их не загружает (см. события ниже)
+    topics = db.relationship('Topic', backref='category', lazy=True, passive_deletes='all')
     
     def __repr__(self):
         return f'{self.name}'
 
 class Topic(db.Model):
     __tablename__ = 'topics'
+    __table_args__ = (
+        db.Index('ix_topics_category_created', 'category_id', 'created_at', 'id'),
+        db.Index('ix_topics_user_created', 'user_id', 'created_at'),
+        # Сортировки списка тем в админке
+        db.Index('ix_topics_created', 'created_at'),
+        db.Index('ix_topics_reply_count', 'reply_count'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id', ondelete='CASCADE'), nullable=False)
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.now().replace(microsecond=0))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now().replace(microsecond=0))
+    
+    # Счетчик ответов (обновляется событиями ниже)
+    reply_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # Relationships
     
-    posts = db.relationship('Post', backref='topic', lazy=True, cascade='all, delete-orphan')
+    posts = db.relationship('Post', backref='topic', lazy=True, passive_deletes='all')
     
     def __repr__(self):
         return f'<Topic {self.title}>'
 
 class Post(db.Model):
     __tablename__ = 'posts'
+    __table_args__ = (
+        db.Index('ix_posts_topic_created', 'topic_id', 'created_at', 'id'),
+        db.Index('ix_posts_user_created', 'user_id', 'created_at'),
+        db.Index('ix_posts_created', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    topic_id = db.Column(db.Integer, db.ForeignKey('topics.id'), nullable=False)
+    topic_id = db.Column(db.Integer, db.ForeignKey('topics.id', ondelete='CASCADE'), nullable=False)
     content = db.Column(db.Text, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.now().replace(microsecond=0))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now().replace(microsecond=0))
     
     def __repr__(self):
         return f'{self.id}'
 
 
+class ForumStats(db.Model):
+    """Общая статистика форума - одна строка, обновляется событиями ниже"""
+    __tablename__ = 'forum_stats'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    users = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    topics = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    posts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_post = db.Column(db.DateTime)
+    
+    @classmethod
+    def current(cls):
+        return db.session.get(cls, 1)
+    
+    def __repr__(self):
+        return f'<ForumStats {self.users}/{self.topics}/{self.posts}>'
+
+
+class Job(db.Model):
+    """Фоновая задача (см. jobs.py): имя зарегистрированной функции и ее аргументы в JSON"""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), nullable=False)
+    args = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(16), nullable=False, default='queued')  # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.now)  # не раньше этого времени
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    error = db.Column(db.Text)
+    result = db.Column(db.Text)
+    
+    def __repr__(self):
+        return f'<Job {self.id} {self.name} {self.status}>'
+
+# Счетчики меняются прямо в flush, поэтому попадают в ту же транзакцию,
+# что и сама запись. Дочерние строки удаляемых тем и категорий удаляет
+# ON DELETE CASCADE, а счетчики за них вычитаются группировками до удаления.
+
+def _change_stats(connection, **deltas):
+    stats = ForumStats.__table__
+    connection.execute(stats.update()
+                       .where(stats.c.id == 1)
+                       .values({name: stats.c[name] + delta for name, delta in deltas.items()}))
+
+
+def _change_topic_counters(connection, topic, delta):
+    _change_stats(connection, topics=delta)
+    categories = Category.__table__
+    users = User.__table__
+    connection.execute(categories.update()
+                       .where(categories.c.id == topic.category_id)
+                       .values(topic_count=categories.c.topic_count + delta))
+    connection.execute(users.update()
+                       .where(users.c.id == topic.user_id)
+                       .values(topic_count=users.c.topic_count + delta))
+
+
+def _change_post_counters(connection, post, delta):
+    _change_stats(connection, posts=delta)
+    topics = Topic.__table__
+    categories = Category.__table__
+    users = User.__table__
+    connection.execute(topics.update()
+                       .where(topics.c.id == post.topic_id)
+                       .values(reply_count=topics.c.reply_count + delta))
+    category_id = select(topics.c.category_id).where(topics.c.id == post.topic_id).scalar_subquery()
+    connection.execute(categories.update()
+                       .where(categories.c.id == category_id)
+                       .values(post_count=categories.c.post_count + delta))
+    connection.execute(users.update()
+                       .where(users.c.id == post.user_id)
+                       .values(post_count=users.c.post_count + delta))
+
+
+@event.listens_for(User, 'after_insert')
+def _user_inserted(mapper, connection, target):
+    _change_stats(connection, users=1)
+
+
+@event.listens_for(Topic, 'after_insert')
+def _topic_inserted(mapper, connection, target):
+    _change_topic_counters(connection, target, 1)
+
+
+@event.listens_for(Topic, 'before_delete')
+def _topic_deleting(mapper, connection, target):
+    _subtract_posts(connection, Post.__table__.c.topic_id == target.id)
+
+
+@event.listens_for(Topic, 'after_delete')
+def _topic_deleted(mapper, connection, target):
+    _change_topic_counters(connection, target, -1)
+    _reset_last_post(connection)
+
+
+@event.listens_for(Category, 'before_delete')
+def _category_deleting(mapper, connection, target):
+    condition = Topic.__table__.c.category_id == target.id
+    _subtract_posts(connection, condition)
+    _subtract_topics(connection, condition)
+
+
+@event.listens_for(Category, 'after_delete')
+def _category_deleted(mapper, connection, target):
+    _reset_last_post(connection)
+
+
+@event.listens_for(Post, 'after_insert')
+def _post_inserted(mapper, connection, target):
+    _change_post_counters(connection, target, 1)
+    if target.created_at is None:
+        return
+    stats = ForumStats.__table__
+    created_at = literal(target.created_at, db.DateTime)
+    connection.execute(stats.update()
+                       .where(stats.c.id == 1)
+                       .values(last_post=func.max(func.coalesce(stats.c.last_post, created_at), created_at)))
+
+
+@event.listens_for(Post, 'after_delete')
+def _post_deleted(mapper, connection, target):
+    _change_post_counters(connection, target, -1)
+    _reset_last_post(connection)
+
+
+def _reset_last_post(connection):
+    # max(created_at) берется по индексу ix_posts_created
+    stats = ForumStats.__table__
+    posts = Post.__table__
+    connection.execute(stats.update()
+                       .where(stats.c.id == 1)
+                       .values(last_post=select(func.max(posts.c.created_at)).scalar_subquery()))
+
+
+def _subtract(connection, table, column, counts):
+    """Вычитает из счетчика результат группировки counts(key, n)"""
+    connection.execute(table.update()
+                       .where(table.c.id == counts.c.key)
+                       .values({column: table.c[column] - counts.c.n}))
+
+
+def _grouped(key, source, condition):
+    return select(key.label('key'), func.count().label('n'))\
+        .select_from(source).where(condition).group_by(key).subquery()
+
+
+def _subtract_posts(connection, condition):
+    """Вычитает из счетчиков сообщения, подходящие под condition (по posts и topics)"""
+    posts = Post.__table__
+    topics = Topic.__table__
+    source = posts.join(topics, posts.c.topic_id == topics.c.id)
+    total = connection.execute(select(func.count()).select_from(source).where(condition)).scalar()
+    if not total:
+        return
+    _subtract(connection, Topic.__table__, 'reply_count', _grouped(posts.c.topic_id, source, condition))
+    _subtract(connection, Category.__table__, 'post_count', _grouped(topics.c.category_id, source, condition))
+    _subtract(connection, User.__table__, 'post_count', _grouped(posts.c.user_id, source, condition))
+    _change_stats(connection, posts=-total)
+
+
+def _subtract_topics(connection, condition):
+    """То же для тем, подходящих под condition (по topics)"""
+    topics = Topic.__table__
+    total = connection.execute(select(func.count()).select_from(topics).where(condition)).scalar()
+    if not total:
+        return
+    _subtract(connection, Category.__table__, 'topic_count', _grouped(topics.c.category_id, topics, condition))
+    _subtract(connection, User.__table__, 'topic_count', _grouped(topics.c.user_id, topics, condition))
+    _change_stats(connection, topics=-total)
+
+
+def _delete_in_chunks(table, source, condition, subtract, chunk_size):
+    """Удаляет строки table порциями, каждая порция - отдельная транзакция"""
+    deleted = 0
+    while True:
+        ids = db.session.execute(select(table.c.id).select_from(source)
+                                 .where(condition).limit(chunk_size)).scalars().all()
+        if not ids:
+            return deleted
+        connection = db.session.connection()
+        subtract(connection, table.c.id.in_(ids))
+        connection.execute(table.delete().where(table.c.id.in_(ids)))
+        db.session.commit()
+        deleted += len(ids)
+
+
+def delete_topic(topic_id, chunk_size=None):
+    """Удаляет тему со всеми сообщениями, возвращает число удаленных сообщений.
+
+    Сообщения удаляются порциями по chunk_size с коммитом после каждой, чтобы
+    большая тема не держала блокировку записи все время удаления. Сама тема
+    удаляется через ORM, так что ее события (и сброс кэшей) срабатывают как обычно.
+    """
+    chunk_size = chunk_size or CONFIG.DELETE_CHUNK_SIZE
+    posts = Post.__table__
+    topics = Topic.__table__
+    deleted = _delete_in_chunks(posts, posts.join(topics, posts.c.topic_id == topics.c.id),
+                                posts.c.topic_id == topic_id, _subtract_posts, chunk_size)
+    topic = db.session.get(Topic, topic_id)
+    if topic is not None:
+        db.session.delete(topic)
+        db.session.commit()
+    return deleted
+
+
+def delete_category(category_id, chunk_size=None):
+    """Удаляет категорию с темами и сообщениями порциями (см. delete_topic)"""
+    chunk_size = chunk_size or CONFIG.DELETE_CHUNK_SIZE
+    posts = Post.__table__
+    topics = Topic.__table__
+    condition = topics.c.category_id == category_id
+    deleted = _delete_in_chunks(posts, posts.join(topics, posts.c.topic_id == topics.c.id),
+                                condition, _subtract_posts, chunk_size)
+    _delete_in_chunks(topics, topics, condition, _subtract_topics, chunk_size)
+    category = db.session.get(Category, category_id)
+    if category is not None:
+        db.session.delete(category)
+        db.session.commit()
+    return deleted
+
+
+def _set_counter(table, column, counts):
+    """Обнуляет счетчик и записывает в него результат группировки counts(key, n)"""
+    db.session.execute(table.update().values({column: 0}))
+    db.session.execute(table.update()
+                       .where(table.c.id == counts.c.key)
+                       .values({column: counts.c.n}))
+
+
+def rebuild_counters():
+    """Пересчет всех счетчиков по группировкам (по одному проходу на счетчик)"""
+    users = User.__table__
+    categories = Category.__table__
+    topics = Topic.__table__
+    posts = Post.__table__
+    
+    _set_counter(topics, 'reply_count',
+                 select(posts.c.topic_id.label('key'), func.count().label('n'))
+                 .group_by(posts.c.topic_id).subquery())
+    _set_counter(categories, 'topic_count',
+                 select(topics.c.category_id.label('key'), func.count().label('n'))
+                 .group_by(topics.c.category_id).subquery())
+    _set_counter(categories, 'post_count',
+                 select(topics.c.category_id.label('key'), func.sum(topics.c.reply_count).label('n'))
+                 .group_by(topics.c.category_id).subquery())
+    _set_counter(users, 'topic_count',
+                 select(topics.c.user_id.label('key'), func.count().label('n'))
+                 .group_by(topics.c.user_id).subquery())
+    _set_counter(users, 'post_count',
+                 select(posts.c.user_id.label('key'), func.count().label('n'))
+                 .group_by(posts.c.user_id).subquery())
+    db.session.commit()
+
+
+def rebuild_stats():
+    """Пересчет строки forum_stats по текущим таблицам"""
+    stats = ForumStats.__table__
+    connection = db.session.connection()
+    if connection.execute(select(stats.c.id).where(stats.c.id == 1)).first() is None:
+        connection.execute(stats.insert().values(id=1))
+    connection.execute(stats.update().where(stats.c.id == 1).values(
+        users=select(func.count()).select_from(User.__table__).scalar_subquery(),
+        topics=select(func.count()).select_from(Topic.__table__).scalar_subquery(),
+        posts=select(func.count()).select_from(Post.__table__).scalar_subquery(),
+    ))
+    _reset_last_post(connection)
+    db.session.commit()
+
+
+# Полнотекстовый поиск: FTS5-таблицы с внешним содержимым (topics/posts),
+# синхронизируются триггерами, поэтому любые записи в обход ORM тоже попадают в индекс
+SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS search_topics USING fts5(
+        title, content, content='topics', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS search_posts USING fts5(
+        content, content='posts', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER IF NOT EXISTS search_topics_ai AFTER INSERT ON topics BEGIN
+        INSERT INTO search_topics(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_topics_ad AFTER DELETE ON topics BEGIN
+        INSERT INTO search_topics(search_topics, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_topics_au AFTER UPDATE OF title, content ON topics BEGIN
+        INSERT INTO search_topics(search_topics, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO search_topics(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_posts_ai AFTER INSERT ON posts BEGIN
+        INSERT INTO search_posts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_posts_ad AFTER DELETE ON posts BEGIN
+        INSERT INTO search_posts(search_posts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_posts_au AFTER UPDATE OF content ON posts BEGIN
+        INSERT INTO search_posts(search_posts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO search_posts(rowid, content) VALUES (new.id, new.content);
+    END""",
+]
+
+
+def rebuild_search_index():
+    """Полная перестройка поисковых индексов по таблицам topics и posts"""
+    db.session.execute(text("INSERT INTO search_topics(search_topics) VALUES ('rebuild')"))
+    db.session.execute(text("INSERT INTO search_posts(search_posts) VALUES ('rebuild')"))
+    db.session.commit()
+
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas):
+    """Применяет PRAGMA-настройки к только что открытому соединению SQLite"""
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
+
+
+def _sqlite_on_connect(dbapi_connection, connection_record):
+    apply_sqlite_pragmas(dbapi_connection, CONFIG.SQLITE_PRAGMAS)
+
 
 class DataBase:
     
@@ -79,11 +434,95 @@ class DataBase:
         """Инициализация приложения Flask"""
         app.config['SQLALCHEMY_DATABASE_URI'] = CONFIG.SQLALCHEMY_DATABASE_URI
         app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = CONFIG.SQLALCHEMY_TRACK_MODIFICATIONS
+        # Для базы в памяти SQLAlchemy использует свой пул, настройки профиля к нему не подходят
+        if ':memory:' not in CONFIG.SQLALCHEMY_DATABASE_URI:
+            app.config['SQLALCHEMY_ENGINE_OPTIONS'] = CONFIG.ENGINE_PROFILES[CONFIG.PROFILE]
         
         db.init_app(app)
         
         with app.app_context():
+            if db.engine.dialect.name == 'sqlite':
+                event.listen(db.engine, 'connect', _sqlite_on_connect)
             db.create_all()
+            self.upgrade_schema()
+            self.create_search_index()
+    
+    def upgrade_schema(self):
+        """Добавляет в уже существующую базу колонки и индексы, которые db.create_all() не создает"""
+        inspector = inspect(db.engine)
+        added = False
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(db.engine.dialect)}'
+                if column.server_default is not None:
+                    ddl += f" NOT NULL DEFAULT '{column.server_default.arg}'"
+                db.session.execute(text(ddl))
+                added = True
+        db.session.commit()
+        self.upgrade_foreign_keys()
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
+        if added:
+            rebuild_counters()
+        if ForumStats.current() is None:
+            rebuild_stats()
+    
+    def upgrade_foreign_keys(self):
+        """Пересоздает таблицы, у которых в базе нет ON DELETE из моделей.
+
+        SQLite не умеет менять внешние ключи, поэтому таблица копируется в новую
+        по рекомендованной схеме (новая таблица, копия, удаление, переименование).
+        Индексы и поисковые триггеры создаются заново следом в init_app.
+        """
+        inspector = inspect(db.engine)
+        outdated = []
+        for table in db.metadata.sorted_tables:
+            existing = {(tuple(fk['constrained_columns']), (fk.get('options') or {}).get('ondelete'))
+                        for fk in inspector.get_foreign_keys(table.name)}
+            for fk in table.foreign_key_constraints:
+                if fk.ondelete and (tuple(fk.column_keys), fk.ondelete.upper()) not in existing:
+                    outdated.append(table)
+                    break
+        if not outdated:
+            return
+        with db.engine.connect() as connection:
+            # PRAGMA foreign_keys не меняется внутри транзакции
+            connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+            connection.commit()
+            try:
+                for table in outdated:
+                    ddl = str(CreateTable(table).compile(db.engine))
+                    ddl = ddl.replace(f'CREATE TABLE {table.name} ', f'CREATE TABLE {table.name}_new ', 1)
+                    columns = ', '.join(column.name for column in table.columns)
+                    connection.exec_driver_sql(f'DROP TABLE IF EXISTS {table.name}_new')
+                    connection.exec_driver_sql(ddl)
+                    connection.exec_driver_sql(f'INSERT INTO {table.name}_new ({columns}) '
+                                               f'SELECT {columns} FROM {table.name}')
+                    connection.exec_driver_sql(f'DROP TABLE {table.name}')
+                    connection.exec_driver_sql(f'ALTER TABLE {table.name}_new RENAME TO {table.name}')
+                problems = connection.exec_driver_sql('PRAGMA foreign_key_check').all()
+                if problems:
+                    raise RuntimeError(f'Нарушены внешние ключи после пересоздания таблиц: {problems[:5]}')
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                connection.exec_driver_sql(f"PRAGMA foreign_keys={CONFIG.SQLITE_PRAGMAS.get('foreign_keys', 'ON')}")
+                connection.commit()
+
+    def create_search_index(self):
+        """Создает FTS5-таблицы и триггеры; при первом создании заполняет индекс"""
+        exists = inspect(db.engine).has_table('search_posts')
+        for ddl in SEARCH_DDL:
+            db.session.execute(text(ddl))
+        db.session.commit()
+        if not exists:
+            rebuild_search_index()
 
 if __name__ == "__main__":
     from flask import Flask
@@ -0,0 +1,232 @@
+"""Конкурентность синхронного (WSGI, поток на соединение) и async (ASGI) режимов при равной памяти.
+
+Каждый режим запускается отдельным процессом-сервером на той же базе:
+    sync  - app3.app на многопоточном сервере Werkzeug (как flask run);
+    async - asgi_app.application на Hypercorn, один процесс.
+Нагрузка - C одновременных клиентов по страницам чтения (index, about, category,
+topic, profile) в течение --seconds секунд на каждую ступень C. Для каждой ступени
+считаются запросы в секунду, задержки p50/p95/p99, ошибки, пиковая память
+сервера (VmRSS) и число его потоков.
+
+Сравнение "при равной памяти": бюджет --memory-mb (по умолчанию - пик памяти
+async-режима на последней ступени); для каждого режима берется самая высокая
+ступень, которая уложилась в бюджет с ошибками меньше 1%.
+
+Кэши страниц и запросов есть только у синхронного приложения, поэтому оба
+сервера запускаются с FORUM_PAGE_CACHE=0 и FORUM_QUERY_CACHE=0.
+
+Запуск из корня проекта (нужны зависимости из requirements-async.txt):
+    python benchmarks/bench_asgi.py --db /tmp/bench.db --concurrency 8 32 128 512 --seconds 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_routes import git_commit, percentile
+
+
+def build_routes(path):
+    """Те же страницы, что у bench_routes: самая большая тема и категория, самый активный автор"""
+    connection = sqlite3.connect(path)
+    topic, = connection.execute('SELECT id FROM topics ORDER BY reply_count DESC LIMIT 1').fetchone()
+    category, = connection.execute('SELECT id FROM categories ORDER BY topic_count DESC LIMIT 1').fetchone()
+    user, = connection.execute('SELECT username FROM users ORDER BY post_count DESC LIMIT 1').fetchone()
+    connection.close()
+    return ['/', '/about', f'/category/{category}', f'/topic/{topic}', f'/profile/{user}']
+
+
+# Серверы
+
+def serve(mode, port):
+    if mode == 'sync':
+        from werkzeug.serving import make_server
+        from app3 import app
+        make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+    else:
+        from hypercorn.asyncio import serve as hypercorn_serve
+        from hypercorn.config import Config
+        from asgi_app import application
+        config = Config()
+        config.bind = [f'127.0.0.1:{port}']
+        config.accesslog = None
+        config.backlog = 1024
+        asyncio.run(hypercorn_serve(application, config))
+
+
+def start_server(mode, port, env):
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', mode, '--port', str(port)],
+                               cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'Сервер {mode} завершился с кодом {process.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise SystemExit(f'Сервер {mode} не запустился за 60 с')
+
+
+def process_status(pid):
+    """VmRSS (МБ) и число потоков процесса из /proc"""
+    values = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            values[name] = value.split()[0] if value.split() else ''
+    return int(values['VmRSS']) / 1024, int(values['Threads'])
+
+
+# Нагрузка
+
+async def fetch(port, url, timeout):
+    reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+    try:
+        writer.write(f'GET {url} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n'
+                     f'Accept-Encoding: identity\r\n\r\n'.encode())
+        await writer.drain()
+        # Connection: close - тело читается до закрытия соединения, без разбора chunked
+        response = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    return int(response.split(b' ', 2)[1])
+
+
+async def run_level(port, pid, routes, concurrency, seconds, timeout):
+    latencies = []
+    errors = 0
+    peak = {'rss_mb': 0.0, 'threads': 0}
+    deadline = time.monotonic() + seconds
+
+    async def client(number):
+        nonlocal errors
+        i = number
+        while time.monotonic() < deadline:
+            url = routes[i % len(routes)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                status = await fetch(port, url, timeout)
+            except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+                errors += 1
+                continue
+            if status != 200:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    async def sample():
+        while time.monotonic() < deadline:
+            rss, threads = process_status(pid)
+            peak['rss_mb'] = max(peak['rss_mb'], rss)
+            peak['threads'] = max(peak['threads'], threads)
+            await asyncio.sleep(0.1)
+
+    started = time.perf_counter()
+    await asyncio.gather(sample(), *(client(number) for number in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    total = len(latencies) + errors
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        'error_rate': round(errors / total, 4) if total else 0,
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        'peak_rss_mb': round(peak['rss_mb'], 1),
+        'peak_threads': peak['threads'],
+    }
+
+
+def equal_memory(modes, budget):
+    summary = {'budget_mb': budget}
+    for mode, levels in modes.items():
+        fitting = [level for level in levels if level['peak_rss_mb'] <= budget and level['error_rate'] < 0.01]
+        best = max(fitting, key=lambda level: level['concurrency'], default=None)
+        summary[mode] = best and {'concurrency': best['concurrency'], 'rps': best['rps'], 'p95_ms': best['p95_ms']}
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='путь к заполненной базе (иначе создается временная --scale)')
+    parser.add_argument('--scale', default='10k', help='размер временной базы: 1k, 10k, 100k, 1m')
+    parser.add_argument('--modes', nargs='*', default=['sync', 'async'], choices=['sync', 'async'])
+    parser.add_argument('--concurrency', nargs='*', type=int, default=[8, 32, 128, 512])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--timeout', type=float, default=30, help='секунд на один запрос')
+    parser.add_argument('--memory-mb', type=float, help='бюджет памяти для сравнения')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--serve', choices=['sync', 'async'], help=argparse.SUPPRESS)
+    parser.add_argument('--output', help='файл для JSON (по умолчанию stdout)')
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+
+    path = args.db
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        os.remove(path)
+    # У async-представлений нет кэшей страниц и запросов: для честного сравнения они выключены в обоих режимах
+    env = dict(os.environ, FORUM_DATABASE_URI=f'sqlite:///{os.path.abspath(path)}',
+               FORUM_JOBS='0', FORUM_PROFILE='production', FORUM_PAGE_CACHE='0', FORUM_QUERY_CACHE='0')
+    if args.db is None:
+        subprocess.run([sys.executable, os.path.join(ROOT, 'benchmarks', 'seed_data.py'), '--scale', args.scale],
+                       cwd=ROOT, env=env, check=True, stdout=sys.stderr)
+    routes = build_routes(path)
+
+    result = {'commit': git_commit(), 'routes': routes, 'seconds': args.seconds,
+              'page_cache': False, 'query_cache': False, 'modes': {}}
+    for mode in args.modes:
+        server = start_server(mode, args.port, env)
+        try:
+            asyncio.run(run_level(args.port, server.pid, routes, 4, 1, args.timeout))   # прогрев
+            levels = []
+            for concurrency in args.concurrency:
+                level = asyncio.run(run_level(args.port, server.pid, routes, concurrency,
+                                              args.seconds, args.timeout))
+                print(f'{mode} x{concurrency}: {level["rps"]} запр/с, p95 {level["p95_ms"]} мс, '
+                      f'{level["peak_rss_mb"]} МБ, ошибок {level["errors"]}', file=sys.stderr)
+                levels.append(level)
+            result['modes'][mode] = levels
+        finally:
+            server.terminate()
+            server.wait()
+
+    budget = args.memory_mb
+    if budget is None and result['modes']:
+        budget = result['modes'].get('async', next(iter(result['modes'].values())))[-1]['peak_rss_mb']
+    result['equal_memory'] = equal_memory(result['modes'], budget)
+
+    if args.db is None:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""Бенчмарк страниц форума через тестовый клиент Flask.
+
+Для каждого маршрута считает задержку (p50/p95/p99), число SQL-запросов на запрос
+пиковую память процесса и цену gzip-сжатия ответа (байты до/после, процессорное
+время на ответ). Результат - JSON, чтобы сравнивать прогоны между коммитами.
+
+Запуск из корня проекта:
+    python benchmarks/bench_routes.py --scale 10k --requests 50 --output bench.json
+
+Уровень сжатия задается --compression-level (или FORUM_COMPRESSION_LEVEL),
+--encoding identity отключает сжатие со стороны клиента.
+
+Кэши страниц и запросов по умолчанию выключены, чтобы измерялась сама работа
+страниц; --cache включает их. Состояние кэшей записывается в результат.
+JSON пишется в stdout (или в --output), все остальное, что печатает
+приложение, уходит в stderr.
+
+Без --db создается временная база нужного размера; с --db используется готовая
+(например, заполненная benchmarks/seed_data.py).
+"""
+import argparse
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def peak_rss_mb():
+    # ru_maxrss в Linux - килобайты
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_routes(User, Category, Topic):
+    """Маршруты для прогона: самая большая тема, самая большая категория, самый активный автор"""
+    topic = Topic.query.order_by(Topic.reply_count.desc()).first()
+    category = Category.query.order_by(Category.topic_count.desc()).first()
+    user = User.query.order_by(User.post_count.desc()).first()
+    public = [
+        ('index', '/'),
+        ('about', '/about'),
+        ('category', f'/category/{category.id}'),
+        ('category_last', f'/category/{category.id}?page=last'),
+        ('topic', f'/topic/{topic.id}'),
+        ('topic_last', f'/topic/{topic.id}?page=last'),
+        ('profile', f'/profile/{user.username}'),
+        ('search', '/search?q=sqlite'),
+    ]
+    admin = [
+        ('admin_dashboard', '/admin'),
+        ('admin_users', '/admin/users'),
+        ('admin_topics', '/admin/topics'),
+        ('admin_posts', '/admin/posts'),
+        ('admin_categories', '/admin/categories'),
+        ('admin_jobs', '/admin/jobs'),
+        ('admin_slow_queries', '/admin/slow-queries'),
+    ]
+    return public, admin
+
+
+def measure(client, url, requests, warmup, counter, compression, headers):
+    for _ in range(warmup):
+        client.get(url, headers=headers)
+    latencies = []
+    queries = []
+    sizes = []
+    status = None
+    compression.reset_stats()
+    for _ in range(requests):
+        counter['n'] = 0
+        started = time.perf_counter()
+        response = client.get(url, headers=headers)
+        sizes.append(len(response.get_data()))
+        latencies.append(time.perf_counter() - started)
+        queries.append(counter['n'])
+        status = response.status_code
+    compressed = compression.stats()
+    return {
+        'url': url,
+        'status': status,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'queries_per_request': round(sum(queries) / len(queries), 1),
+        'response_bytes': round(sum(sizes) / len(sizes)),
+        'compressed_responses': compressed['responses'],
+        'compression_ratio': compressed['ratio'],
+        'compression_cpu_ms': compressed['cpu_ms_per_response'],
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', default='10k', help='размер временной базы: 1k, 10k, 100k, 1m')
+    parser.add_argument('--db', help='путь к уже заполненной базе')
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--only', nargs='*', help='имена маршрутов для прогона')
+    parser.add_argument('--encoding', default='gzip', help='Accept-Encoding клиента (identity - без сжатия)')
+    parser.add_argument('--compression-level', type=int, help='уровень gzip 1-9 (FORUM_COMPRESSION_LEVEL)')
+    parser.add_argument('--cache', action='store_true', help='включить кэши страниц и запросов')
+    parser.add_argument('--output', help='файл для JSON (по умолчанию stdout)')
+    args = parser.parse_args()
+
+    path = args.db
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+    os.environ['FORUM_DATABASE_URI'] = f'sqlite:///{os.path.abspath(path)}'
+    # Потоки фоновых задач опрашивают очередь и попали бы в счетчик запросов
+    os.environ.setdefault('FORUM_JOBS', '0')
+    if args.compression_level is not None:
+        os.environ['FORUM_COMPRESSION_LEVEL'] = str(args.compression_level)
+    os.environ.setdefault('FORUM_PAGE_CACHE', '1' if args.cache else '0')
+    os.environ.setdefault('FORUM_QUERY_CACHE', '1' if args.cache else '0')
+
+    # Приложение печатает в stdout (например, имя администратора при входе), а там должен быть только JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        result = run(args, path)
+
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+def run(args, path):
+    from sqlalchemy import event
+    from app3 import app, compression
+    from bd_app3 import db, User, Category, Topic
+    from config import CONFIG
+    from seed_data import ADMIN, SCALES, seed
+
+    counter = {'n': 0}
+
+    def count_query(*args):
+        counter['n'] += 1
+
+    headers = {'Accept-Encoding': args.encoding}
+    result = {'commit': git_commit(), 'requests': args.requests, 'encoding': args.encoding,
+              'compression_level': compression.level,
+              'page_cache': CONFIG.PAGE_CACHE, 'query_cache': CONFIG.QUERY_CACHE, 'routes': {}}
+    with app.app_context():
+        if User.query.first() is None:
+            started = time.perf_counter()
+            result['data'] = seed(SCALES[args.scale])
+            result['seed_seconds'] = round(time.perf_counter() - started, 1)
+        public, admin = build_routes(User, Category, Topic)
+        event.listen(db.engine, 'before_cursor_execute', count_query)
+
+    anonymous = app.test_client()
+    logged_in = app.test_client()
+    logged_in.post('/login', data={'form_type': 'login', **ADMIN}, headers=headers)
+    for client, routes in ((anonymous, public), (logged_in, admin)):
+        for name, url in routes:
+            if args.only and name not in args.only:
+                continue
+            result['routes'][name] = measure(client, url, args.requests, args.warmup,
+                                             counter, compression, headers)
+            print(f'{name}: {result["routes"][name]["p50_ms"]} мс', file=sys.stderr)
+    result['peak_rss_mb'] = peak_rss_mb()
+
+    if args.db is None:
+        with app.app_context():
+            db.engine.dispose()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    return result
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Задержка полнотекстового поиска (search.py) на базе заданного размера.
+
+Для каждого случая - частое слово, префикс, два слова, фильтры, последняя
+разрешенная страница - считает p50/p95 вызова search() и число совпадений
+в FTS-таблицах, чтобы было видно, как цена зависит от размера выдачи.
+
+Запуск из корня проекта:
+    python benchmarks/bench_search.py --scale 1m --requests 20 --output search.json
+
+Без --db создается временная база (benchmarks/seed_data.py, --scale).
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_routes import git_commit, percentile
+
+
+def cases(max_pages):
+    return [
+        ('word', 'sqlite', {}),
+        ('prefix', 'поис', {}),
+        ('two_words', 'форум кэш', {}),
+        ('missing', 'несуществующееслово', {}),
+        ('category', 'sqlite', {'category_id': 1}),
+        ('author', 'sqlite', {'author': 'user5'}),
+        ('last_page', 'sqlite', {'page': max_pages}),
+        ('beyond_last_page', 'sqlite', {'page': max_pages + 1}),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', default='100k', help='размер временной базы: 1k, 10k, 100k, 1m')
+    parser.add_argument('--db', help='путь к уже заполненной базе')
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--output', help='файл для JSON (по умолчанию stdout)')
+    args = parser.parse_args()
+
+    path = args.db
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+    os.environ['FORUM_DATABASE_URI'] = f'sqlite:///{os.path.abspath(path)}'
+    os.environ.setdefault('FORUM_JOBS', '0')
+
+    with contextlib.redirect_stdout(sys.stderr):
+        result = run(args, path)
+
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+def run(args, path):
+    from sqlalchemy import text
+    from app3 import app
+    from bd_app3 import db, Post, User
+    from config import CONFIG
+    from search import build_match, search
+    from seed_data import SCALES, seed
+
+    result = {'commit': git_commit(), 'requests': args.requests, 'per_page': CONFIG.SEARCH_PER_PAGE,
+              'max_pages': CONFIG.SEARCH_MAX_PAGES, 'candidates': CONFIG.SEARCH_CANDIDATES, 'cases': {}}
+    with app.app_context():
+        if User.query.first() is None:
+            seed(SCALES[args.scale])
+        result['posts'] = Post.query.count()
+        for name, query, options in cases(CONFIG.SEARCH_MAX_PAGES):
+            kwargs = dict(per_page=CONFIG.SEARCH_PER_PAGE, max_pages=CONFIG.SEARCH_MAX_PAGES,
+                          candidates=CONFIG.SEARCH_CANDIDATES, **options)
+            search(query, **kwargs)
+            latencies = []
+            for _ in range(args.requests):
+                started = time.perf_counter()
+                results, has_next = search(query, **kwargs)
+                latencies.append(time.perf_counter() - started)
+            matches = {table: db.session.execute(text(f'SELECT count(*) FROM {table} WHERE {table} MATCH :match'),
+                                                 {'match': build_match(query)}).scalar()
+                       for table in ('search_topics', 'search_posts')}
+            result['cases'][name] = {
+                'query': query, **options, 'matches': matches, 'results': len(results), 'has_next': has_next,
+                'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+                'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            }
+            print(f'{name}: {result["cases"][name]["p50_ms"]} мс', file=sys.stderr)
+
+    if args.db is None:
+        with app.app_context():
+            db.engine.dispose()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    return result
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Генератор тестовых данных для бенчмарков: пользователи, категории, темы и сообщения.
+
+Размер тем неравномерный (распределение Ципфа): несколько огромных веток и много маленьких.
+Вставка идет пачками через Core, минуя ORM, после чего пересчитываются счетчики и статистика.
+
+Запуск из корня проекта:
+    FORUM_DATABASE_URI=sqlite:////tmp/bench.db python benchmarks/seed_data.py --scale 100k
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert
+
+from bd_app3 import db, User, Category, Topic, Post, rebuild_counters, rebuild_stats
+
+SCALES = {'1k': 1_000, '10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+ADMIN = {'username': 'admin', 'password': 'admin'}
+BATCH = 5_000
+WORDS = ('форум тема сообщение ответ вопрос sqlite flask python индекс запрос страница '
+         'пользователь категория поиск кэш данные скорость память время').split()
+
+
+def text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def insert_batches(connection, table, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH:
+            connection.execute(insert(table), batch)
+            batch = []
+    if batch:
+        connection.execute(insert(table), batch)
+
+
+def seed(posts, seed=1, categories=10, skew=1.1):
+    """Заполняет пустую базу; вызывать внутри app_context()"""
+    rng = random.Random(seed)
+    users = max(10, posts // 50)
+    topics = max(5, posts // 20)
+    start = datetime.now() - timedelta(days=365)
+    step = timedelta(days=365) / (topics + posts)
+
+    with db.engine.begin() as connection:
+        insert_batches(connection, User.__table__, (
+            {'id': i, 'username': ADMIN['username'] if i == 1 else f'user{i}', 'email': f'user{i}@example.com',
+             'password': ADMIN['password'] if i == 1 else 'password', 'created_at': start}
+            for i in range(1, users + 1)))
+        insert_batches(connection, Category.__table__, (
+            {'id': i, 'user_id': 1, 'name': f'Категория {i}', 'description': text(rng, 8), 'created_at': start}
+            for i in range(1, categories + 1)))
+        insert_batches(connection, Topic.__table__, (
+            {'id': i, 'user_id': rng.randint(1, users), 'category_id': rng.randint(1, categories),
+             'title': text(rng, 5), 'content': text(rng, 30), 'created_at': start + step * i}
+            for i in range(1, topics + 1)))
+
+        # Тема с номером k получает долю сообщений ~ 1 / k^skew
+        weights = [1 / (k ** skew) for k in range(1, topics + 1)]
+        topic_ids = rng.choices(range(1, topics + 1), weights=weights, k=posts)
+        insert_batches(connection, Post.__table__, (
+            {'id': i, 'user_id': rng.randint(1, users), 'topic_id': topic_ids[i - 1],
+             'content': text(rng, rng.randint(5, 80)), 'created_at': start + step * (topics + i)}
+            for i in range(1, posts + 1)))
+
+    rebuild_counters()
+    rebuild_stats()
+    return {'users': users, 'categories': categories, 'topics': topics, 'posts': posts}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=SCALES, default='10k')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    from app3 import app
+    with app.app_context():
+        if User.query.first() is not None:
+            raise SystemExit('База не пустая, укажите новую через FORUM_DATABASE_URI')
+        started = time.perf_counter()
+        sizes = seed(SCALES[args.scale], seed=args.seed)
+    print(f'{sizes} за {time.perf_counter() - started:.1f} с')
+
+
+if __name__ == '__main__':
+    main()
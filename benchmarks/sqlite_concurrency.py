@@ -0,0 +1,137 @@
+"""Конкурентная нагрузка чтение/запись на SQLite: настройки по умолчанию против CONFIG.SQLITE_PRAGMAS.
+
+Запуск из корня проекта:
+    python benchmarks/sqlite_concurrency.py --writers 4 --readers 8 --seconds 10
+
+Для каждого варианта создается отдельная временная база, результат печатается в JSON.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event, insert, select
+from sqlalchemy.exc import OperationalError
+
+from bd_app3 import db, User, Category, Topic, Post, apply_sqlite_pragmas
+from config import CONFIG
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def make_engine(path, pragmas, pool_size):
+    engine = create_engine(f'sqlite:///{path}', pool_size=pool_size, max_overflow=0)
+    if pragmas:
+        event.listen(engine, 'connect', lambda conn, record: apply_sqlite_pragmas(conn, pragmas))
+    return engine
+
+
+def seed(engine, topics, posts):
+    db.metadata.create_all(engine)
+    now = datetime.now()
+    with engine.begin() as conn:
+        conn.execute(insert(User.__table__), [{'id': 1, 'username': 'bench', 'email': 'bench@example.com',
+                                               'password': 'bench', 'created_at': now}])
+        conn.execute(insert(Category.__table__), [{'id': 1, 'user_id': 1, 'name': 'bench', 'created_at': now}])
+        conn.execute(insert(Topic.__table__), [{'id': i, 'user_id': 1, 'category_id': 1, 'title': f'topic {i}',
+                                                'content': 'text', 'created_at': now} for i in range(1, topics + 1)])
+        conn.execute(insert(Post.__table__), [{'user_id': 1, 'topic_id': i % topics + 1, 'content': f'post {i}',
+                                               'created_at': now} for i in range(posts)])
+
+
+def run(name, pragmas, args):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    engine = make_engine(path, pragmas, args.writers + args.readers)
+    seed(engine, args.topics, args.posts)
+
+    posts = Post.__table__
+    stop = threading.Event()
+    lock = threading.Lock()
+    stats = {'write': [], 'read': [], 'write_errors': 0, 'read_errors': 0}
+
+    def writer(n):
+        i = 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                with engine.begin() as conn:
+                    conn.execute(insert(posts).values(user_id=1, topic_id=(n + i) % args.topics + 1,
+                                                      content=f'reply {n}-{i}', created_at=datetime.now()))
+            except OperationalError:
+                with lock:
+                    stats['write_errors'] += 1
+                continue
+            with lock:
+                stats['write'].append(time.perf_counter() - started)
+            i += 1
+
+    def reader(n):
+        i = 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                with engine.connect() as conn:
+                    conn.execute(select(posts)
+                                 .where(posts.c.topic_id == (n + i) % args.topics + 1)
+                                 .order_by(posts.c.created_at, posts.c.id)
+                                 .limit(CONFIG.POSTS_PER_PAGE)).all()
+            except OperationalError:
+                with lock:
+                    stats['read_errors'] += 1
+                continue
+            with lock:
+                stats['read'].append(time.perf_counter() - started)
+            i += 1
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(args.writers)]
+    threads += [threading.Thread(target=reader, args=(n,)) for n in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    result = {'profile': name}
+    for kind in ('write', 'read'):
+        latencies = stats[kind]
+        result[kind] = {
+            'ops_per_sec': round(len(latencies) / args.seconds, 1),
+            'errors': stats[f'{kind}_errors'],
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--topics', type=int, default=100)
+    parser.add_argument('--posts', type=int, default=10000)
+    args = parser.parse_args()
+
+    results = [run('sqlite-default', {}, args), run('tuned', CONFIG.SQLITE_PRAGMAS, args)]
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
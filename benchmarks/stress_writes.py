@@ -0,0 +1,198 @@
+"""Нагрузка на запись: приложение поднимается в многопоточном WSGI-сервере,
+N клиентов одновременно входят на форум, отвечают в темы и читают их.
+
+Считает пропускную способность, долю ошибок блокировки SQLite и хвостовые задержки.
+
+Запуск из корня проекта:
+    python benchmarks/stress_writes.py --clients 16 --seconds 20 --write-ratio 0.3
+
+Без --db создается временная база (benchmarks/seed_data.py, --scale).
+JSON пишется в stdout (или в --output), все остальное, что печатает
+приложение, уходит в stderr.
+"""
+import argparse
+import contextlib
+import http.cookiejar
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+LOCK_STATUS = 503
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * p / 100))] * 1000, 2)
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Ответ на POST - редирект, переход по нему не входит в замер записи
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def make_client(base_url, username, password):
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar), NoRedirect())
+    data = urllib.parse.urlencode({'form_type': 'login', 'username': username, 'password': password}).encode()
+    try:
+        opener.open(base_url + '/login', data=data)
+    except urllib.error.HTTPError as error:
+        if error.code != 302:
+            raise
+    return opener
+
+
+def request(opener, url, data=None):
+    """Возвращает HTTP-статус; редиректы и ошибки - это тоже статусы"""
+    try:
+        response = opener.open(url, data=data)
+        response.read()
+        return response.status
+    except urllib.error.HTTPError as error:
+        error.read()
+        return error.code
+
+
+def serve(app, port):
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--write-ratio', type=float, default=0.3, help='доля запросов на запись')
+    parser.add_argument('--scale', default='10k')
+    parser.add_argument('--db', help='путь к уже заполненной базе')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--output', help='файл для JSON (по умолчанию stdout)')
+    args = parser.parse_args()
+
+    path = args.db
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+    os.environ['FORUM_DATABASE_URI'] = f'sqlite:///{os.path.abspath(path)}'
+
+    # Приложение печатает в stdout (имя пользователя при входе), а там должен быть только JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        result = run(args, path)
+
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+def run(args, path):
+    from sqlalchemy.exc import OperationalError
+    from app3 import app
+    from bd_app3 import db, User, Topic
+    from seed_data import SCALES, seed
+
+    with app.app_context():
+        if User.query.first() is None:
+            seed(SCALES[args.scale])
+        users = User.query.count()
+        topics = Topic.query.count()
+
+    # Ошибку блокировки отдаем отдельным статусом, чтобы отличать ее от прочих 500
+    @app.errorhandler(OperationalError)
+    def database_locked(error):
+        db.session.rollback()
+        if 'locked' in str(error.orig) or 'busy' in str(error.orig):
+            return 'database is locked', LOCK_STATUS
+        raise error
+
+    server = serve(app, args.port)
+    base_url = f'http://127.0.0.1:{args.port}'
+
+    lock = threading.Lock()
+    stats = {kind: {'latency': [], 'ok': 0, 'lock_errors': 0, 'other_errors': 0} for kind in ('read', 'write')}
+    stop = threading.Event()
+
+    def client(n):
+        rng = random.Random(n)
+        user_id = 2 + n % max(1, users - 1)
+        opener = make_client(base_url, f'user{user_id}', 'password')
+        i = 0
+        while not stop.is_set():
+            topic_id = rng.randint(1, topics)
+            if rng.random() < args.write_ratio:
+                kind, expected = 'write', 302
+                data = urllib.parse.urlencode({'content': f'стресс {n}-{i}'}).encode()
+                url = f'{base_url}/topic/{topic_id}'
+            else:
+                kind, expected, data = 'read', 200, None
+                url = f'{base_url}/topic/{topic_id}?page=last'
+            started = time.perf_counter()
+            status = request(opener, url, data)
+            elapsed = time.perf_counter() - started
+            with lock:
+                bucket = stats[kind]
+                if status == expected:
+                    bucket['ok'] += 1
+                    bucket['latency'].append(elapsed)
+                elif status == LOCK_STATUS:
+                    bucket['lock_errors'] += 1
+                else:
+                    bucket['other_errors'] += 1
+            i += 1
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(args.clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - started
+    server.shutdown()
+
+    result = {'clients': args.clients, 'seconds': round(duration, 1), 'write_ratio': args.write_ratio}
+    for kind, bucket in stats.items():
+        total = bucket['ok'] + bucket['lock_errors'] + bucket['other_errors']
+        result[kind] = {
+            'requests': total,
+            'ok_per_sec': round(bucket['ok'] / duration, 1),
+            'lock_errors': bucket['lock_errors'],
+            'lock_error_rate': round(bucket['lock_errors'] / total, 4) if total else 0,
+            'other_errors': bucket['other_errors'],
+            'p50_ms': percentile(bucket['latency'], 50),
+            'p95_ms': percentile(bucket['latency'], 95),
+            'p99_ms': percentile(bucket['latency'], 99),
+        }
+
+    if args.db is None:
+        with app.app_context():
+            db.engine.dispose()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    return result
+
+
+if __name__ == '__main__':
+    main()
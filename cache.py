@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, joinedload, object_session
+
+from bd_app3 import db, User, Category, Topic, Post, ForumStats
+from config import CONFIG
+
+# Запись в таблицу меняет и счетчики в других таблицах (см. события в bd_app3.py),
+# поэтому сбрасывать нужно и их версии
+DEPENDENT_TABLES = {
+    'posts': ('posts', 'topics', 'categories', 'users', 'forum_stats'),
+    'topics': ('topics', 'categories', 'users', 'forum_stats'),
+    'users': ('users', 'forum_stats'),
+    'categories': ('categories',),
+    'forum_stats': ('forum_stats',),
+}
+
+
+class QueryCache:
+    """Кэш результатов запросов с версиями таблиц.
+
+    У каждой таблицы есть счетчик версии, его увеличивают ORM-события записи.
+    Запись кэша помнит версии таблиц, от которых зависит, и считается
+    устаревшей, как только одна из них изменилась. Плюс LRU по размеру и TTL.
+
+    Объекты моделей загружаются отдельной короткой сессией и отдаются
+    запросу через merge(load=False), так что кэш никогда не делит
+    один экземпляр между потоками.
+
+    Версии таблиц живут в памяти процесса: записи из другого процесса
+    (второй рабочий процесс сервера, команды flask, seed_data) этот кэш
+    не сбрасывают, и он отдает старые данные до QUERY_CACHE_TTL. Кэш
+    рассчитан на сервер из одного процесса с потоками; при нескольких
+    процессах его надо выключить (FORUM_QUERY_CACHE=0).
+    """
+
+    def __init__(self, app=None):
+        self.enabled = CONFIG.QUERY_CACHE
+        self.max_size = CONFIG.QUERY_CACHE_SIZE
+        self.ttl = CONFIG.QUERY_CACHE_TTL
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        for model in (User, Category, Topic, Post, ForumStats):
+            for name in ('after_insert', 'after_update', 'after_delete'):
+                event.listen(model, name, self._row_changed)
+        event.listen(Session, 'after_commit', self._session_finished)
+        event.listen(Session, 'after_soft_rollback', self._session_rolled_back)
+
+    # Версии таблиц
+
+    def invalidate(self, *tables):
+        """Сбрасывает все записи, зависящие от указанных таблиц"""
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+    def _row_changed(self, mapper, connection, target):
+        tables = DEPENDENT_TABLES.get(mapper.local_table.name, (mapper.local_table.name,))
+        self.invalidate(*tables)
+        # Повторим сброс после коммита: иначе между flush и commit
+        # другой поток может закэшировать старые данные уже под новой версией
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault('cache_tables', set()).update(tables)
+
+    def _session_finished(self, session):
+        tables = session.info.pop('cache_tables', None)
+        if tables:
+            self.invalidate(*tables)
+
+    def _session_rolled_back(self, session, previous_transaction):
+        if previous_transaction.parent is None:
+            self._session_finished(session)
+
+    # Чтение
+
+    def cached(self, key, tables, loader, ttl=None):
+        """Значение loader() из кэша; tables - таблицы, от которых оно зависит"""
+        if not self.enabled:
+            return loader()
+        now = time.monotonic()
+        with self._lock:
+            versions = tuple(self._versions.get(table, 0) for table in tables)
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == versions and entry[2] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        value = loader()
+        with self._lock:
+            self._entries[key] = (value, versions, now + (ttl or self.ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return value
+
+    def get(self, model, id, *relationships):
+        """Аналог model.query.get(id); relationships - имена связей для joinedload"""
+        try:
+            id = int(id)
+        except (TypeError, ValueError):
+            return None
+        tables = [model.__tablename__]
+        tables += [getattr(model, name).property.mapper.local_table.name for name in relationships]
+        options = [joinedload(getattr(model, name)) for name in relationships]
+        if not self.enabled:
+            return db.session.get(model, id, options=options)
+
+        def load():
+            with Session(db.engine) as session:
+                return session.get(model, id, options=options)
+
+        obj = self.cached(('get', model.__tablename__, id) + relationships, tables, load)
+        if obj is None:
+            return None
+        return db.session.merge(obj, load=False)
+
+    def all(self, model):
+        """Аналог model.query.all() для небольших справочных таблиц"""
+        if not self.enabled:
+            return model.query.all()
+
+        def load():
+            with Session(db.engine) as session:
+                return session.query(model).all()
+
+        objects = self.cached(('all', model.__tablename__), [model.__tablename__], load)
+        return [db.session.merge(obj, load=False) for obj in objects]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 3) if total else 0.0,
+                'entries': len(self._entries),
+                'max_size': self.max_size,
+            }
@@ -0,0 +1,216 @@
+import itertools
+import threading
+import time
+import zlib
+
+from werkzeug.datastructures import Headers
+
+from config import CONFIG
+from streaming import ClosingBody
+
+# Ответы с таким статусом не сжимаются: у них нет тела или оно - часть файла
+SKIP_STATUSES = ('204', '206', '304')
+
+
+class Compression:
+    """gzip-сжатие ответов на уровне WSGI (оборачивает app.wsgi_app).
+
+    Сжимаются только ответы из COMPRESSION_MIMETYPES не меньше
+    COMPRESSION_MIN_SIZE байт, если клиент прислал Accept-Encoding: gzip и
+    ответ еще не сжат (заранее сжатая статика из assets.py идет как есть).
+    Потоковые ответы без Content-Length сжимаются по частям: каждая часть
+    сбрасывается в сеть сразу (Z_SYNC_FLUSH), поэтому поток не задерживается.
+
+    compress() сжимает готовое тело целиком - для ответов, которые идут мимо
+    WSGI (async-представления asgi_app.py).
+
+    stats() - сколько ответов сжато, байты до/после и процессорное время на сжатие.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = CONFIG.COMPRESSION
+        self.level = CONFIG.COMPRESSION_LEVEL
+        self.min_size = CONFIG.COMPRESSION_MIN_SIZE
+        self.mimetypes = set(CONFIG.COMPRESSION_MIMETYPES)
+        self._lock = threading.Lock()
+        self.reset_stats()
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.wsgi_app = app.wsgi_app
+        app.wsgi_app = self
+
+    def reset_stats(self):
+        with self._lock:
+            self.responses = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.cpu_time = 0.0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'level': self.level,
+                'responses': self.responses,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'ratio': round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else 0.0,
+                'cpu_ms': round(self.cpu_time * 1000, 2),
+                'cpu_ms_per_response': round(self.cpu_time * 1000 / self.responses, 3) if self.responses else 0.0,
+            }
+
+    def _account(self, bytes_in, bytes_out, cpu_time, finished=False):
+        with self._lock:
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.cpu_time += cpu_time
+            if finished:
+                self.responses += 1
+
+    # WSGI
+
+    def __call__(self, environ, start_response):
+        if not self.enabled or environ.get('REQUEST_METHOD') == 'HEAD':
+            return self.wsgi_app(environ, start_response)
+
+        started = {}
+
+        def capture(status, headers, exc_info=None):
+            started['status'] = status
+            started['headers'] = Headers(headers)
+            started['exc_info'] = exc_info
+            return _unsupported_write
+
+        body = self.wsgi_app(environ, capture)
+        return self._respond(body, started, start_response, accepts_gzip(environ.get('HTTP_ACCEPT_ENCODING', '')))
+
+    def compress(self, status, headers, data, accepts_gzip):
+        """Тело для отправки, при необходимости сжатое; заголовки правятся на месте"""
+        if not self.enabled or not self._compressible(status, headers):
+            return data
+        _vary(headers)
+        if not accepts_gzip or len(data) < self.min_size:
+            return data
+        _mark_gzip(headers)
+        cpu = time.thread_time()
+        compressed = gzip_compress(data, self.level)
+        self._account(len(data), len(compressed), time.thread_time() - cpu, finished=True)
+        headers['Content-Length'] = str(len(compressed))
+        return compressed
+
+    def _respond(self, body, started, start_response, accepts_gzip):
+        chunks = iter(body)
+        pending = []
+        if 'status' not in started:
+            # Приложение может вызвать start_response только при первой итерации
+            pending.append(next(chunks, b''))
+        status, headers = started['status'], started['headers']
+
+        if not self._compressible(status, headers):
+            start_response(status, headers.to_wsgi_list(), started['exc_info'])
+            return _chain(pending, chunks, body)
+        _vary(headers)
+
+        length = headers.get('Content-Length', type=int)
+        if not accepts_gzip or (length is not None and length < self.min_size):
+            start_response(status, headers.to_wsgi_list(), started['exc_info'])
+            return _chain(pending, chunks, body)
+
+        # Для потокового ответа размер заранее не известен: копим начало до порога
+        size = sum(len(chunk) for chunk in pending)
+        while length is None and size < self.min_size:
+            chunk = next(chunks, None)
+            if chunk is None:
+                start_response(status, headers.to_wsgi_list(), started['exc_info'])
+                return _chain(pending, iter(()), body)
+            pending.append(chunk)
+            size += len(chunk)
+
+        _mark_gzip(headers)
+        if length is not None:
+            data = b''.join(pending) + b''.join(chunks)
+            _close(body)
+            cpu = time.thread_time()
+            compressed = gzip_compress(data, self.level)
+            self._account(len(data), len(compressed), time.thread_time() - cpu, finished=True)
+            headers['Content-Length'] = str(len(compressed))
+            start_response(status, headers.to_wsgi_list(), started['exc_info'])
+            return [compressed]
+        start_response(status, headers.to_wsgi_list(), started['exc_info'])
+        return self._stream(pending, chunks, body)
+
+    def _compressible(self, status, headers):
+        if status[:3] in SKIP_STATUSES or 'Content-Encoding' in headers:
+            return False
+        if 'no-transform' in headers.get('Cache-Control', ''):
+            return False
+        mimetype = headers.get('Content-Type', '').split(';')[0].strip().lower()
+        return mimetype in self.mimetypes
+
+    def _stream(self, pending, chunks, body):
+        return ClosingBody(self._gzip_chunks(itertools.chain(pending, chunks)), lambda error: _close(body))
+
+    def _gzip_chunks(self, chunks):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            if not chunk:
+                continue
+            cpu = time.thread_time()
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            self._account(len(chunk), len(data), time.thread_time() - cpu)
+            yield data
+        cpu = time.thread_time()
+        data = compressor.flush()
+        self._account(0, len(data), time.thread_time() - cpu, finished=True)
+        yield data
+
+
+def gzip_compress(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _unsupported_write(data):
+    raise RuntimeError('write() не поддерживается при сжатии ответов')
+
+
+def accepts_gzip(accept_encoding):
+    """Принимает ли клиент gzip по значению заголовка Accept-Encoding"""
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+
+def _vary(headers):
+    # Ответ зависит от Accept-Encoding, даже если этот клиент получит его без сжатия
+    vary = headers.get('Vary')
+    if not vary:
+        headers['Vary'] = 'Accept-Encoding'
+    elif 'accept-encoding' not in vary.lower() and vary != '*':
+        headers['Vary'] = vary + ', Accept-Encoding'
+
+
+def _mark_gzip(headers):
+    headers['Content-Encoding'] = 'gzip'
+    headers.remove('Content-Length')
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        # Сжатый ответ не совпадает побайтно с несжатым
+        headers['ETag'] = 'W/' + etag
+
+
+def _chain(pending, chunks, body):
+    """Сначала уже прочитанные части, затем остаток; close() исходного тела в конце.
+
+    Не генератор с finally: сервер может закрыть ответ, не начав его читать,
+    и тогда исходное тело (с соединением к базе) осталось бы незакрытым.
+    """
+    return ClosingBody(itertools.chain(pending, chunks), lambda error: _close(body))
+
+
+def _close(body):
+    if body is not None and hasattr(body, 'close'):
+        body.close()
@@ -0,0 +1,95 @@
+import hashlib
+import os
+
+from flask import g, request, session
+
+from bd_app3 import Post, Topic
+
+
+class ConditionalGet:
+    """ETag для страниц тем, категорий и профилей.
+
+    Представление считает дешевый валидатор (счетчики и ключ последней записи,
+    это поиск по индексу) до тяжелых запросов и, если у клиента актуальная
+    версия, сразу отвечает 304 без рендеринга шаблона.
+
+    ETag слабый (W/): счетчики сообщений авторов на странице темы могут
+    отставать, пока в самой теме ничего не менялось.
+
+    Last-Modified эти страницы не отдают: время изменения не хранится, а
+    время последней записи не меняется, когда запись удаляют, и клиент с
+    одним If-Modified-Since получил бы устаревшую страницу. check() умеет
+    Last-Modified для валидаторов, которые знают настоящее время изменения.
+    """
+
+    def __init__(self, app=None):
+        self.salt = ''
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Новая версия шаблонов - новые ETag
+        templates = os.path.join(app.root_path, app.template_folder)
+        mtimes = [os.path.getmtime(os.path.join(root, name))
+                  for root, dirs, files in os.walk(templates) for name in files]
+        self.salt = str(max(mtimes, default=0))
+        app.after_request(self._add_headers)
+
+    def check(self, parts, last_modified=None):
+        """Ответ 304, если версия клиента актуальна, иначе None (валидаторы попадут в ответ)"""
+        if request.method != 'GET' or '_flashes' in session:
+            return None
+        etag = self.etag(parts, session)
+        g.conditional = (etag, last_modified)
+        if request.if_none_match:
+            modified = not request.if_none_match.contains_weak(etag)
+        elif request.if_modified_since and last_modified is not None:
+            modified = last_modified.replace(microsecond=0) > request.if_modified_since.replace(tzinfo=None)
+        else:
+            modified = True
+        if modified:
+            return None
+        return '', 304
+
+    def etag(self, parts, session):
+        """ETag страницы для этого посетителя; его же считает async-приложение (asgi_app.py)"""
+        viewer = (session.get('user_id'), session.get('username'), session.get('admin'))
+        return hashlib.sha1(repr((self.salt, viewer) + parts).encode()).hexdigest()[:24]
+
+    def _add_headers(self, response):
+        if 'conditional' not in g:
+            # Страница из кэша уже несет свой ETag
+            if request.method == 'GET' and response.status_code == 200 and 'ETag' in response.headers:
+                response.make_conditional(request)
+            return response
+        if response.status_code not in (200, 304):
+            return response
+        etag, last_modified = g.pop('conditional')
+        response.set_etag(etag, weak=True)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        # Страница зависит от сессии, проверять актуальность надо при каждом показе
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+def last_row(query, model):
+    """(created_at, id) последней строки выборки - поиск по индексу (..., created_at, id)"""
+    return query.with_entities(model.created_at, model.id)\
+        .order_by(model.created_at.desc(), model.id.desc())\
+        .first()
+
+
+def topic_validator(topic):
+    last = last_row(Post.query.filter(Post.topic_id == topic.id), Post)
+    return ('topic', topic.id, topic.reply_count, tuple(last) if last else None), None
+
+
+def category_validator(category):
+    last = last_row(Topic.query.filter(Topic.category_id == category.id), Topic)
+    return ('category', category.id, category.topic_count, category.post_count, tuple(last) if last else None), None
+
+
+def profile_validator(user):
+    last = last_row(Post.query.filter(Post.user_id == user.id), Post)
+    return ('profile', user.id, user.post_count, user.topic_count, tuple(last) if last else None), None
@@ -1,5 +1,140 @@
+import os
+
+
+def _env(name, default):
+    """Значение переменной окружения FORUM_<name>, приведенное к типу default"""
+    value = os.environ.get(f'FORUM_{name}')
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float):
+        return float(value)
+    return value
+
+
 class CONFIG:
-    db = 'forum.db'
-    SQLALCHEMY_DATABASE_URI = f'sqlite:///{db}'
+    db = _env('DB', 'forum.db')
+    SQLALCHEMY_DATABASE_URI = _env('DATABASE_URI', f'sqlite:///{db}')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    SECRET_KEY = 'your-secret-key-here'
+    SECRET_KEY = _env('SECRET_KEY', 'your-secret-key-here')
+
+    # Пагинация
+    TOPICS_PER_PAGE = 20
+    POSTS_PER_PAGE = 20
+    SEARCH_PER_PAGE = 20
+    # Поиск (search.py): глубина выдачи в страницах и сколько самых новых совпадений каждой
+    # FTS-таблицы ранжируется по bm25 (сортируются только они, а не все совпадения)
+    SEARCH_MAX_PAGES = _env('SEARCH_MAX_PAGES', 10)
+    SEARCH_CANDIDATES = _env('SEARCH_CANDIDATES', 2000)
+    ADMIN_PER_PAGE = _env('ADMIN_PER_PAGE', 50)
+
+    # Настройки SQLite, применяются к каждому новому соединению.
+    # Любую можно переопределить через FORUM_SQLITE_<ИМЯ>, например FORUM_SQLITE_BUSY_TIMEOUT=10000
+    SQLITE_PRAGMAS = {
+        'journal_mode': _env('SQLITE_JOURNAL_MODE', 'WAL'),        # читатели не ждут писателя
+        'busy_timeout': _env('SQLITE_BUSY_TIMEOUT', 5000),         # мс ожидания блокировки вместо ошибки
+        'synchronous': _env('SQLITE_SYNCHRONOUS', 'NORMAL'),       # в режиме WAL безопасно и без fsync на каждый коммит
+        'mmap_size': _env('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+        'cache_size': _env('SQLITE_CACHE_SIZE', -64 * 1024),       # отрицательное значение - размер в КБ
+        'temp_store': _env('SQLITE_TEMP_STORE', 'MEMORY'),
+        'foreign_keys': _env('SQLITE_FOREIGN_KEYS', 'ON'),
+    }
+
+    # Подсчет SQL-запросов на каждый запрос (всегда включен в debug-режиме)
+    SQL_DEBUG = _env('SQL_DEBUG', False)
+    SQL_N_PLUS_ONE_THRESHOLD = _env('SQL_N_PLUS_ONE_THRESHOLD', 5)
+
+    # Групповой коммит новых тем и сообщений через один поток-писатель (write_queue.py)
+    GROUP_COMMIT = _env('GROUP_COMMIT', False)
+    GROUP_COMMIT_MAX_BATCH = _env('GROUP_COMMIT_MAX_BATCH', 64)
+    GROUP_COMMIT_MAX_DELAY_MS = _env('GROUP_COMMIT_MAX_DELAY_MS', 5)
+    GROUP_COMMIT_TIMEOUT = _env('GROUP_COMMIT_TIMEOUT', 10)
+
+    # Кэш результатов запросов (cache.py). Только для сервера из одного процесса: записи
+    # других процессов (рабочих процессов gunicorn, команд flask) он не видит до TTL
+    QUERY_CACHE = _env('QUERY_CACHE', True)
+    QUERY_CACHE_SIZE = _env('QUERY_CACHE_SIZE', 1024)
+    QUERY_CACHE_TTL = _env('QUERY_CACHE_TTL', 300)
+
+    # Кэш готовых страниц для гостей (page_cache.py). Как и кэш запросов, только для одного процесса
+    PAGE_CACHE = _env('PAGE_CACHE', True)
+    PAGE_CACHE_SIZE = _env('PAGE_CACHE_SIZE', 512)
+    PAGE_CACHE_TTL = _env('PAGE_CACHE_TTL', 60)
+    PAGE_CACHE_WAIT = _env('PAGE_CACHE_WAIT', 5)
+    # Тема с большим числом авторов сбрасывается при любом новом сообщении
+    PAGE_CACHE_MAX_AUTHORS = _env('PAGE_CACHE_MAX_AUTHORS', 100)
+
+    # gzip-сжатие ответов (compression.py); уровень 1-9, размер в байтах
+    COMPRESSION = _env('COMPRESSION', True)
+    COMPRESSION_LEVEL = _env('COMPRESSION_LEVEL', 6)
+    COMPRESSION_MIN_SIZE = _env('COMPRESSION_MIN_SIZE', 1024)
+    COMPRESSION_MIMETYPES = (
+        'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+        'application/javascript', 'application/json', 'application/x-ndjson', 'image/svg+xml',
+    )
+
+    # Потоковый рендеринг больших страниц (streaming.py)
+    STREAM_BUFFER_SIZE = _env('STREAM_BUFFER_SIZE', 8192)   # байт в одном куске ответа
+    STREAM_YIELD_PER = _env('STREAM_YIELD_PER', 100)        # строк за одно чтение из курсора
+
+    # Удаление больших тем и категорий порциями, по транзакции на порцию (bd_app3.delete_topic)
+    DELETE_CHUNK_SIZE = _env('DELETE_CHUNK_SIZE', 500)
+
+    # Фоновые задачи (jobs.py); время в секундах. Исполнителей запускает точка входа сервера
+    # (python app3.py, asgi_app) или отдельный процесс flask --app app3 jobs-worker
+    JOBS = _env('JOBS', True)
+    JOB_WORKERS = _env('JOB_WORKERS', 2)
+    JOB_POLL_INTERVAL = _env('JOB_POLL_INTERVAL', 2)
+    JOB_RETRY_BACKOFF = _env('JOB_RETRY_BACKOFF', 5)
+    JOB_MAX_ATTEMPTS = _env('JOB_MAX_ATTEMPTS', 3)
+    JOB_TIMEOUT = _env('JOB_TIMEOUT', 3600)
+
+    # Метрики Prometheus на /metrics (metrics.py); с токеном нужен заголовок Authorization: Bearer <токен>,
+    # без токена метрики отдаются только запросам с localhost
+    METRICS = _env('METRICS', True)
+    METRICS_TOKEN = _env('METRICS_TOKEN', '')
+    METRICS_SHARDS = _env('METRICS_SHARDS', 16)
+    METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)       # секунды
+    METRICS_DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1)
+
+    # Журнал медленных запросов с планами (slow_queries.py); файл в папке instance, ротация по размеру
+    SLOW_QUERY_LOG_ENABLED = _env('SLOW_QUERY_LOG_ENABLED', True)
+    SLOW_QUERY_MS = _env('SLOW_QUERY_MS', 100)
+    SLOW_QUERY_LOG = _env('SLOW_QUERY_LOG', 'slow_queries.log')
+    SLOW_QUERY_LOG_MAX_BYTES = _env('SLOW_QUERY_LOG_MAX_BYTES', 5 * 1024 * 1024)
+    SLOW_QUERY_LOG_BACKUPS = _env('SLOW_QUERY_LOG_BACKUPS', 3)
+
+    # Профилирование запросов (profiler.py): ?_profile=1 для администратора и выборка
+    # PROFILE_SAMPLE_RATE процентов трафика; файлы в папке instance/<PROFILE_DIR>
+    PROFILER = _env('PROFILER', True)
+    PROFILE_SAMPLE_RATE = _env('PROFILE_SAMPLE_RATE', 0.0)
+    PROFILE_INTERVAL_MS = _env('PROFILE_INTERVAL_MS', 2)        # шаг выборки; явный collapsed точный
+    PROFILE_DIR = _env('PROFILE_DIR', 'profiles')
+    PROFILE_KEEP = _env('PROFILE_KEEP', 200)
+    PROFILE_LIMIT = _env('PROFILE_LIMIT', 60)                   # строк в отчете cProfile
+
+    # Трассировка запросов (tracing.py): спаны в формате OTLP/JSON, по строке на запрос
+    # в instance/<TRACE_LOG>; TRACE_SAMPLE_RATE - процент записываемых запросов
+    TRACING = _env('TRACING', False)
+    TRACE_SAMPLE_RATE = _env('TRACE_SAMPLE_RATE', 100.0)
+    TRACE_LOG = _env('TRACE_LOG', 'traces.jsonl')
+    TRACE_LOG_MAX_BYTES = _env('TRACE_LOG_MAX_BYTES', 20 * 1024 * 1024)
+    TRACE_LOG_BACKUPS = _env('TRACE_LOG_BACKUPS', 3)
+    TRACE_MAX_SPANS = _env('TRACE_MAX_SPANS', 1000)
+    TRACE_STATEMENT_LENGTH = _env('TRACE_STATEMENT_LENGTH', 1000)
+    TRACE_SERVICE_NAME = _env('TRACE_SERVICE_NAME', 'forum')
+
+    # ASGI-режим (asgi_app.py): страницы чтения через AsyncSession, остальное - синхронное приложение
+    ASYNC_DATABASE_DRIVER = _env('ASYNC_DATABASE_DRIVER', 'sqlite+aiosqlite')
+    ASGI_WSGI_THREADS = _env('ASGI_WSGI_THREADS', 10)          # потоков для синхронных маршрутов
+
+    # Профиль запуска выбирает настройки пула соединений (FORUM_PROFILE)
+    PROFILE = _env('PROFILE', 'development')
+    ENGINE_PROFILES = {
+        'development': {'pool_size': 5, 'max_overflow': 10, 'pool_timeout': 30},
+        'production': {'pool_size': 20, 'max_overflow': 20, 'pool_timeout': 10},
+        'benchmark': {'pool_size': 64, 'max_overflow': 0, 'pool_timeout': 30},
+    }
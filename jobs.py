@@ -0,0 +1,224 @@
+import json
+import os
+import random
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from bd_app3 import db, Job
+from config import CONFIG
+
+
+class JobRunner:
+    """Фоновые задачи с очередью в таблице jobs.
+
+    Запрос ставит задачу (enqueue) и сразу отвечает, а JOB_WORKERS потоков
+    забирают задачи из таблицы. Задача
+    забирается одним UPDATE ... RETURNING, поэтому ее не возьмут два потока
+    или два процесса. Упавшая задача повторяется через JOB_RETRY_BACKOFF *
+    2^(попытка-1) секунд, после max_attempts попыток остается в статусе failed.
+    Очередь в базе переживает перезапуск: задачи, зависшие в running дольше
+    JOB_TIMEOUT, возвращаются в очередь при старте.
+
+    Импорт приложения и init_app потоков не запускают (иначе они появлялись
+    бы в каждом процессе, который просто импортирует app3: flask shell,
+    команды CLI, тесты). Их запускает start() из точки входа сервера:
+    python app3.py, asgi_app, либо отдельный процесс flask jobs-worker для
+    остальных WSGI-серверов. Процесс с исполнителями раз в JOB_POLL_INTERVAL
+    обновляет отметку instance/jobs.heartbeat, по ней alive() видит
+    исполнителей и в другом процессе. Если живых исполнителей нет, enqueue
+    выполняет задачу сразу, в запросе, а /admin/jobs предупреждает, что
+    очередь стоит.
+
+    С FORUM_JOBS=0 потоки не запускаются, и enqueue выполняет задачу сразу,
+    одной попыткой.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = CONFIG.JOBS
+        self.workers = CONFIG.JOB_WORKERS
+        self.poll_interval = CONFIG.JOB_POLL_INTERVAL
+        self.backoff = CONFIG.JOB_RETRY_BACKOFF
+        self.max_attempts = CONFIG.JOB_MAX_ATTEMPTS
+        self.timeout = CONFIG.JOB_TIMEOUT
+        self.tasks = {}
+        self._wake = threading.Event()
+        self._threads = []
+        self.heartbeat = None
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.heartbeat = os.path.join(app.instance_path, 'jobs.heartbeat')
+
+    def start(self, wait=False):
+        """Возвращает зависшие задачи в очередь и запускает потоки-исполнители.
+
+        Повторный вызов ничего не делает; с wait=True ждет потоки (для flask jobs-worker).
+        """
+        if not self.enabled:
+            return False
+        if not self._threads:
+            with self.app.app_context():
+                self._requeue_stale()
+            os.makedirs(self.app.instance_path, exist_ok=True)
+            self._beat()
+            targets = [(self._run, f'forum-jobs-{number}') for number in range(self.workers)]
+            for target, name in targets + [(self._keep_beating, 'forum-jobs-heartbeat')]:
+                thread = threading.Thread(target=target, name=name, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        return True
+
+    def alive(self):
+        """Есть ли живые исполнители - в этом процессе или в другом"""
+        if any(thread.is_alive() for thread in self._threads):
+            return True
+        try:
+            return time.time() - os.path.getmtime(self.heartbeat) < 3 * self.poll_interval
+        except OSError:
+            return False
+
+    def task(self, name):
+        """Декоратор: регистрирует функцию как задачу с именем name"""
+        def register(function):
+            self.tasks[name] = function
+            return function
+        return register
+
+    def enqueue(self, name, max_attempts=None, **kwargs):
+        """Ставит задачу в очередь и возвращает ее id; аргументы должны сериализоваться в JSON"""
+        if name not in self.tasks:
+            raise KeyError(f'Неизвестная задача: {name}')
+        if not self.enabled:
+            # Без потоков повторять некому: одна попытка прямо сейчас
+            max_attempts = 1
+        inline = not self.enabled or not self.alive()
+        job = Job(name=name, args=json.dumps(kwargs, ensure_ascii=False),
+                  max_attempts=max_attempts or self.max_attempts)
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+        if inline:
+            # Исполнителей нет (FORUM_JOBS=0 или сервер их не запустил): иначе задача ждала бы вечно.
+            # Упавшая задача остается в очереди до появления исполнителя
+            self._execute(self._claim(job_id))
+        else:
+            self._wake.set()
+        return job_id
+
+    def retry(self, job_id):
+        """Возвращает упавшую задачу в очередь с новым счетчиком попыток"""
+        jobs = Job.__table__
+        updated = db.session.execute(jobs.update()
+                                     .where(jobs.c.id == job_id, jobs.c.status == 'failed')
+                                     .values(status='queued', attempts=0, run_at=datetime.now(),
+                                             error=None, finished_at=None)).rowcount
+        db.session.commit()
+        if updated and self.enabled and self.alive():
+            self._wake.set()
+        elif updated:
+            self._execute(self._claim(job_id))
+        return bool(updated)
+
+    def stats(self):
+        """Число задач по статусам"""
+        jobs = Job.__table__
+        rows = db.session.execute(select(jobs.c.status, func.count()).group_by(jobs.c.status)).all()
+        return dict(rows)
+
+    # Потоки-исполнители
+
+    def _beat(self):
+        with open(self.heartbeat, 'a'):
+            os.utime(self.heartbeat)
+
+    def _keep_beating(self):
+        while True:
+            try:
+                self._beat()
+            except OSError:
+                self.app.logger.exception('Не удалось обновить отметку исполнителей задач')
+            time.sleep(self.poll_interval)
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                try:
+                    job = self._claim()
+                    if job is None:
+                        self._wake.wait(self.poll_interval)
+                        self._wake.clear()
+                        continue
+                    self._execute(job)
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('Ошибка в потоке фоновых задач')
+                    self._wake.wait(self.poll_interval)
+                finally:
+                    db.session.remove()
+
+    def _claim(self, job_id=None):
+        """Атомарно переводит следующую готовую задачу (или задачу job_id) в running"""
+        jobs = Job.__table__
+        now = datetime.now()
+        if job_id is None:
+            job_id = select(jobs.c.id)\
+                .where(jobs.c.status == 'queued', jobs.c.run_at <= now)\
+                .order_by(jobs.c.run_at, jobs.c.id)\
+                .limit(1)\
+                .scalar_subquery()
+        row = db.session.execute(jobs.update()
+                                 .where(jobs.c.id == job_id, jobs.c.status == 'queued')
+                                 .values(status='running', started_at=now, attempts=jobs.c.attempts + 1)
+                                 .returning(jobs.c.id, jobs.c.name, jobs.c.args,
+                                            jobs.c.attempts, jobs.c.max_attempts)).first()
+        db.session.commit()
+        return row
+
+    def _execute(self, job):
+        if job is None:
+            return
+        jobs = Job.__table__
+        if job.name not in self.tasks:
+            # Задачу поставила другая версия приложения или она еще не зарегистрирована
+            db.session.execute(jobs.update().where(jobs.c.id == job.id).values(
+                status='queued', attempts=jobs.c.attempts - 1,
+                run_at=datetime.now() + timedelta(seconds=self.poll_interval)))
+            db.session.commit()
+            return
+        try:
+            function = self.tasks[job.name]
+            result = function(**json.loads(job.args))
+        except Exception as error:
+            db.session.rollback()
+            values = {'error': ''.join(traceback.format_exception(error))[-4000:]}
+            if job.attempts < job.max_attempts:
+                delay = self.backoff * 2 ** (job.attempts - 1) * random.uniform(1, 1.25)
+                values.update(status='queued', run_at=datetime.now() + timedelta(seconds=delay))
+                self.app.logger.warning('Задача %s #%d упала (попытка %d), повтор через %.0f с: %s',
+                                        job.name, job.id, job.attempts, delay, error)
+            else:
+                values.update(status='failed', finished_at=datetime.now())
+                self.app.logger.error('Задача %s #%d упала окончательно: %s', job.name, job.id, error)
+        else:
+            values = {'status': 'done', 'finished_at': datetime.now(), 'error': None,
+                      'result': json.dumps(result, ensure_ascii=False, default=str)}
+        db.session.execute(jobs.update().where(jobs.c.id == job.id).values(values))
+        db.session.commit()
+
+    def _requeue_stale(self):
+        # Задачи процесса, который умер посреди выполнения
+        jobs = Job.__table__
+        db.session.execute(jobs.update()
+                           .where(jobs.c.status == 'running',
+                                  jobs.c.started_at < datetime.now() - timedelta(seconds=self.timeout))
+                           .values(status='queued', run_at=datetime.now()))
+        db.session.commit()
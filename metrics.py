@@ -0,0 +1,232 @@
+import bisect
+import hmac
+import threading
+import time
+
+from flask import Response, abort, g, has_request_context, request
+from flask import before_render_template, template_rendered, request_started, request_tearing_down
+from sqlalchemy import event
+from werkzeug.datastructures import WWWAuthenticate
+
+from bd_app3 import db
+from config import CONFIG
+from streaming import ClosingBody
+
+COUNTERS = {
+    'forum_http_requests_total': 'Запросы по endpoint, методу и статусу',
+    'forum_http_requests_started_total': 'Начатые запросы',
+    'forum_http_requests_finished_total': 'Завершенные запросы (вместе с отправкой потокового тела)',
+    'forum_db_queries_total': 'SQL-запросы по endpoint',
+}
+
+HISTOGRAMS = {
+    'forum_http_request_duration_seconds': ('Время запроса по endpoint', CONFIG.METRICS_BUCKETS),
+    'forum_db_query_duration_seconds': ('Время SQL-запроса по endpoint', CONFIG.METRICS_DB_BUCKETS),
+    'forum_template_render_seconds': ('Время рендеринга шаблона', CONFIG.METRICS_BUCKETS),
+}
+
+
+class _Shard:
+    """Часть счетчиков, в которую пишет группа потоков; у каждой части свой замок"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+
+class Metrics:
+    """Метрики приложения в текстовом формате Prometheus на /metrics.
+
+    Время запросов по endpoint, статусы, запросы в работе, число и время
+    SQL-запросов по endpoint, время рендеринга шаблонов и показатели кэшей.
+    С METRICS_TOKEN /metrics требует Authorization: Bearer <токен>, без него
+    отдается только запросам с localhost.
+    Счетчики разбиты на METRICS_SHARDS частей по id потока, поэтому потоки
+    сервера почти не ждут друг друга; при чтении /metrics части складываются.
+
+    Значения, которые дешевле посчитать при чтении (кэши, очередь задач),
+    добавляются через collector().
+    """
+
+    def __init__(self, app=None):
+        self.enabled = CONFIG.METRICS
+        self.token = CONFIG.METRICS_TOKEN
+        self._shards = [_Shard() for _ in range(CONFIG.METRICS_SHARDS)]
+        self._collectors = []
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not self.enabled:
+            return
+        request_started.connect(self._request_started, app)
+        request_tearing_down.connect(self._request_finished, app)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_finished, app)
+        app.after_request(self._remember_status)
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._query_started)
+            event.listen(db.engine, 'after_cursor_execute', self._query_finished)
+        app.add_url_rule('/metrics', 'metrics', self._expose)
+
+    # Запись
+
+    def _shard(self):
+        return self._shards[threading.get_native_id() % len(self._shards)]
+
+    def inc(self, name, labels=(), value=1):
+        shard = self._shard()
+        key = (name, labels)
+        with shard.lock:
+            shard.counters[key] = shard.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        index = bisect.bisect_left(buckets, value)
+        shard = self._shard()
+        key = (name, labels)
+        with shard.lock:
+            values = shard.histograms.get(key)
+            if values is None:
+                # Счетчики по корзинам (последняя - +Inf), сумма, количество
+                values = shard.histograms[key] = [0] * (len(buckets) + 1) + [0.0, 0]
+            values[index] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def collector(self, function):
+        """Регистрирует функцию, которая при чтении /metrics возвращает
+        [(имя, тип, описание, [(метки, значение), ...]), ...]"""
+        self._collectors.append(function)
+        return function
+
+    # Запросы, SQL и шаблоны
+
+    def _request_started(self, sender, **extra):
+        g.metrics_started = time.perf_counter()
+        self.inc('forum_http_requests_started_total')
+
+    def _remember_status(self, response):
+        g.metrics_status = response.status_code
+        if response.is_streamed and 'metrics_started' in g:
+            # Flask закрывает запрос до отдачи потокового тела: запрос завершится вместе с телом
+            labels = (_endpoint(), request.method, response.status_code, g.pop('metrics_started'))
+            response.response = ClosingBody(response.response, lambda error: self._finish(*labels))
+        return response
+
+    def _request_finished(self, sender, exc=None, **extra):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        status = g.pop('metrics_status', 500 if exc is not None else 200)
+        self._finish(_endpoint(), request.method, status, started)
+
+    def _finish(self, endpoint, method, status, started):
+        self.inc('forum_http_requests_finished_total')
+        self.inc('forum_http_requests_total', (('endpoint', endpoint), ('method', method), ('status', str(status))))
+        self.observe('forum_http_request_duration_seconds', (('endpoint', endpoint),),
+                     time.perf_counter() - started)
+
+    def _query_started(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    def _query_finished(self, conn, cursor, statement, parameters, context, executemany):
+        if not conn.info.get('metrics_query_start'):
+            return
+        elapsed = time.perf_counter() - conn.info['metrics_query_start'].pop()
+        labels = (('endpoint', _endpoint() if has_request_context() else 'background'),)
+        self.inc('forum_db_queries_total', labels)
+        self.observe('forum_db_query_duration_seconds', labels, elapsed)
+
+    def _template_started(self, sender, template, context, **extra):
+        g.setdefault('metrics_templates', []).append(time.perf_counter())
+
+    def _template_finished(self, sender, template, context, **extra):
+        if g.get('metrics_templates'):
+            self.observe('forum_template_render_seconds', (('template', template.name or '-'),),
+                         time.perf_counter() - g.metrics_templates.pop())
+
+    # Выдача
+
+    def _expose(self):
+        if self.token:
+            expected = f'Bearer {self.token}'.encode()
+            if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), expected):
+                abort(401, www_authenticate=WWWAuthenticate('Bearer'))
+        elif not _local_request():
+            # Без токена метрики видны только с этой же машины, и не через прокси
+            abort(403)
+        return Response(self.render(), mimetype='text/plain', headers={'Cache-Control': 'no-store'})
+
+    def render(self):
+        counters = {}
+        histograms = {}
+        for shard in self._shards:
+            with shard.lock:
+                counter_items = list(shard.counters.items())
+                histogram_items = [(key, list(values)) for key, values in shard.histograms.items()]
+            for key, value in counter_items:
+                counters[key] = counters.get(key, 0) + value
+            for key, values in histogram_items:
+                total = histograms.get(key)
+                histograms[key] = values if total is None else [a + b for a, b in zip(total, values)]
+
+        lines = []
+        for name, help in COUNTERS.items():
+            _header(lines, name, 'counter', help)
+            for (sample, labels), value in sorted(counters.items()):
+                if sample == name:
+                    lines.append(f'{name}{_labels(labels)} {_number(value)}')
+        in_flight = (counters.get(('forum_http_requests_started_total', ()), 0)
+                     - counters.get(('forum_http_requests_finished_total', ()), 0))
+        _header(lines, 'forum_http_requests_in_flight', 'gauge', 'Запросы в работе')
+        lines.append(f'forum_http_requests_in_flight {in_flight}')
+
+        for name, (help, buckets) in HISTOGRAMS.items():
+            _header(lines, name, 'histogram', help)
+            for (sample, labels), values in sorted(histograms.items()):
+                if sample != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ['+Inf'], values):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", str(bound)),))} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {values[-2]:.6f}')
+                lines.append(f'{name}_count{_labels(labels)} {values[-1]}')
+
+        for function in self._collectors:
+            for name, kind, help, samples in function():
+                _header(lines, name, kind, help)
+                for labels, value in samples:
+                    lines.append(f'{name}{_labels(tuple(labels))} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _endpoint():
+    return request.endpoint or 'none'
+
+
+def _local_request():
+    forwarded = 'X-Forwarded-For' in request.headers or 'Forwarded' in request.headers
+    return request.remote_addr in ('127.0.0.1', '::1') and not forwarded
+
+
+def _header(lines, name, kind, help):
+    lines.append(f'# HELP {name} {help}')
+    lines.append(f'# TYPE {name} {kind}')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (f'{name}="{_escape(value)}"' for name, value in labels)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,210 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, request, session
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session, object_session
+
+from bd_app3 import db, User, Category, Topic, Post
+from config import CONFIG
+
+
+def _topic_tags(args):
+    # У каждого сообщения темы выводится счетчик сообщений автора, а он меняется
+    # и от сообщений в других темах: страница зависит еще и от авторов темы
+    posts = Post.__table__
+    authors = db.session.execute(select(posts.c.user_id).distinct()
+                                 .where(posts.c.topic_id == args['topic_id'])
+                                 .limit(CONFIG.PAGE_CACHE_MAX_AUTHORS + 1)).scalars().all()
+    if len(authors) > CONFIG.PAGE_CACHE_MAX_AUTHORS:
+        return [f"topic:{args['topic_id']}", 'post_counts']
+    return [f"topic:{args['topic_id']}"] + [f'user:{user_id}' for user_id in authors]
+
+
+# Страницы, которые кэшируются для гостей, и метки, по которым они сбрасываются.
+# Метки считаются при построении страницы и хранятся вместе с ней
+CACHED_PAGES = {
+    'index': lambda args: ['index'],
+    'about': lambda args: ['about'],
+    'category': lambda args: [f"category:{args['category_id']}"],
+    'topic': _topic_tags,
+}
+
+
+class PageCache:
+    """Кэш готовых страниц для гостей (запросы без сессии), ключ - URL.
+
+    Каждая страница помечена метками (index, category:<id>, topic:<id>, about,
+    а тема еще user:<id> своих авторов - из-за их счетчиков сообщений, или
+    post_counts, если авторов больше PAGE_CACHE_MAX_AUTHORS). ORM-события
+    записи увеличивают версии меток, и страницы с устаревшими версиями
+    перестают отдаваться. При промахе страницу строит только один запрос,
+    остальные ждут его результата (single-flight), чтобы горячая тема не
+    вызывала лавину одинаковых запросов к базе.
+
+    Версии меток, как и у кэша запросов, живут в памяти процесса: записи из
+    других процессов страницы не сбрасывают, те устаревают только по
+    PAGE_CACHE_TTL. При нескольких процессах сервера кэш надо выключить
+    (FORUM_PAGE_CACHE=0).
+    """
+
+    def __init__(self, app=None):
+        self.enabled = CONFIG.PAGE_CACHE
+        self.max_size = CONFIG.PAGE_CACHE_SIZE
+        self.ttl = CONFIG.PAGE_CACHE_TTL
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._building = {}
+        self._changes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        for model in (Category, Topic, Post):
+            for name in ('after_insert', 'after_update', 'after_delete'):
+                event.listen(model, name, self._row_changed)
+        event.listen(Post, 'after_insert', self._post_counted)
+        event.listen(Post, 'after_delete', self._post_counted)
+        event.listen(User, 'after_insert', self._user_added)
+        event.listen(User, 'after_update', self._user_changed)
+        event.listen(User, 'after_delete', self._user_deleted)
+        event.listen(Session, 'after_commit', self._session_finished)
+        app.before_request(self._serve)
+        app.after_request(self._store)
+        app.teardown_request(self._release)
+
+    # Метки
+
+    def invalidate(self, *tags):
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+            self._changes += 1
+
+    def _row_changed(self, mapper, connection, target):
+        if isinstance(target, Post):
+            topics = Topic.__table__
+            category_id = connection.execute(select(topics.c.category_id)
+                                             .where(topics.c.id == target.topic_id)).scalar()
+            tags = [f'topic:{target.topic_id}', f'category:{category_id}', 'index', 'about']
+        elif isinstance(target, Topic):
+            tags = [f'topic:{target.id}', f'category:{target.category_id}', 'index', 'about']
+        else:
+            tags = [f'category:{target.id}', 'index']
+        self._mark(target, tags)
+
+    def _post_counted(self, mapper, connection, target):
+        # Счетчик сообщений автора виден рядом с каждым его сообщением, в любой теме
+        self._mark(target, [f'user:{target.user_id}', 'post_counts'])
+
+    def _user_added(self, mapper, connection, target):
+        # Нового пользователя видно только в статистике форума
+        self._mark(target, ['about'])
+
+    def _user_changed(self, mapper, connection, target):
+        # Гостям из полей пользователя видно только имя, зато почти на каждой странице.
+        # Счетчики сообщений меняются запросами Core мимо этих событий, темы с ними
+        # сбрасывает _post_counted
+        if inspect(target).attrs.username.history.has_changes():
+            self._mark(target, ['*'])
+
+    def _user_deleted(self, mapper, connection, target):
+        self._mark(target, ['*'])
+
+    def _mark(self, target, tags):
+        self.invalidate(*tags)
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault('page_tags', set()).update(tags)
+
+    def _session_finished(self, session):
+        tags = session.info.pop('page_tags', None)
+        if tags:
+            self.invalidate(*tags)
+
+    def _versions_of(self, tags):
+        return tuple(self._versions.get(tag, 0) for tag in tags)
+
+    # Обработка запроса
+
+    def _cacheable(self):
+        return (self.enabled and request.method == 'GET'
+                and request.endpoint in CACHED_PAGES and not session)
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry[2] == self._versions_of(entry[1]) and entry[3] > time.monotonic():
+            self._entries.move_to_end(key)
+            return entry[0]
+        return None
+
+    def _serve(self):
+        if not self._cacheable():
+            return None
+        key = request.full_path
+        with self._lock:
+            page = self._lookup(key)
+            if page is None:
+                building = self._building.setdefault(key, threading.Lock())
+        if page is None:
+            # Страницу строит один запрос, остальные ждут его и берут готовую
+            if building.acquire(timeout=CONFIG.PAGE_CACHE_WAIT):
+                g.page_cache_lock = (key, building)
+            with self._lock:
+                page = self._lookup(key)
+                changes = self._changes
+            if page is None:
+                tags = CACHED_PAGES[request.endpoint](request.view_args) + ['*']
+                with self._lock:
+                    self.misses += 1
+                    # Запись во время выборки меток могла добавить в тему автора,
+                    # которого в метках нет: такую страницу не сохраняем
+                    if self._changes == changes:
+                        g.page_cache = (key, tags, self._versions_of(tags))
+                return None
+        with self._lock:
+            self.hits += 1
+        body, status, headers = page
+        return body, status, headers + [('X-Page-Cache', 'HIT')]
+
+    def _store(self, response):
+        if 'page_cache' not in g:
+            return response
+        key, tags, versions = g.pop('page_cache')
+        response.headers['X-Page-Cache'] = 'MISS'
+        if (response.status_code != 200 or response.is_streamed or session
+                or 'Set-Cookie' in response.headers):
+            return response
+        headers = [(name, value) for name, value in response.headers.items()
+                   if name not in ('Content-Length', 'X-Page-Cache')]
+        page = (response.get_data(), response.status_code, headers)
+        with self._lock:
+            self._entries[key] = (page, tags, versions, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return response
+
+    def _release(self, exc):
+        if 'page_cache_lock' not in g:
+            return
+        key, lock = g.pop('page_cache_lock')
+        with self._lock:
+            if self._building.get(key) is lock:
+                del self._building[key]
+        lock.release()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 3) if total else 0.0,
+                'entries': len(self._entries),
+                'max_size': self.max_size,
+            }
@@ -0,0 +1,181 @@
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session
+from config import CONFIG
+
+
+class KeysetPage:
+    """Страница выборки с пагинацией по ключу (created_at, id).
+
+    В отличие от OFFSET каждая страница - это поиск по индексу от курсора,
+    поэтому время выборки не зависит от того, насколько далеко страница.
+    Курсор - это id записи, значения ключа для него берутся из базы.
+
+    order_by задает другие колонки ключа (id всегда добавляется последним,
+    чтобы ключ был уникальным), descending - обратный порядок.
+
+    С stream=True строки не выбираются заранее: они читаются из курсора
+    во время перебора (для stream_page), а флаги и курсоры соседних страниц
+    становятся известны после него. Перебор идет уже после teardown запроса,
+    когда сессия Flask-SQLAlchemy закрыта, поэтому потоковая страница читает
+    в своей сессии и закрывает ее, как только строки выбраны.
+    """
+
+    def __init__(self, query, model, per_page, after=None, before=None, start=None, last=False,
+                 stream=False, order_by=None, descending=False):
+        self.model = model
+        self.per_page = per_page
+        self.columns = tuple(order_by or (model.created_at,)) + (model.id,)
+        self.descending = descending
+        self.key = tuple_(*self.columns)
+        self._request = (query, after, before, start, last)
+        if not stream:
+            self._load()
+
+    def _after(self, cursor, inclusive=False):
+        """Условие "дальше курсора" в порядке страницы"""
+        if self.descending:
+            return self.key <= cursor if inclusive else self.key < cursor
+        return self.key >= cursor if inclusive else self.key > cursor
+
+    def _before(self, cursor):
+        return self.key > cursor if self.descending else self.key < cursor
+
+    def _plan(self, session=None):
+        """Выборка страницы, направление и заранее известный флаг соседней страницы"""
+        query, after, before, start, last = self._request
+        if session is not None:
+            query = query.with_session(session)
+        if after is not None and (cursor := self._cursor(query, after)) is not None:
+            return query.filter(self._after(cursor)), True, True
+        if before is not None and (cursor := self._cursor(query, before)) is not None:
+            return query.filter(self._before(cursor)), False, True
+        if start is not None and (cursor := self._cursor(query, start)) is not None:
+            # Страница, начинающаяся с указанной записи (для ссылок ?post=<id>)
+            has_prev = query.filter(self._before(cursor)).limit(1).first() is not None
+            return query.filter(self._after(cursor, inclusive=True)), True, has_prev
+        if last:
+            return query, False, False
+        return query, True, False
+
+    def _load(self, session=None):
+        query, forward, known = self._plan(session)
+        rows = self._fetch(query, forward).all()
+        self._finish(rows[:self.per_page], len(rows) > self.per_page, forward, known)
+
+    def _own_session(self):
+        return Session(bind=self._request[0].session.get_bind())
+
+    def _stream(self):
+        # Строки читаются из курсора по одной и сразу отдаются шаблону
+        session = self._own_session()
+        try:
+            query, forward, known = self._plan(session)
+            if not forward:
+                # Страницу, выбранную с конца, надо развернуть - целиком ее не миновать
+                self._load(session)
+                session.close()
+                yield from self.items
+                return
+            rows = []
+            more = False
+            for row in self._fetch(query, forward).yield_per(CONFIG.STREAM_YIELD_PER):
+                if len(rows) == self.per_page:
+                    more = True
+                    continue
+                rows.append(row)
+                yield row
+            self._finish(rows, more, forward, known)
+        finally:
+            session.close()
+
+    def _finish(self, rows, more, forward, known):
+        if forward:
+            self.has_prev, self.has_next = known, more
+        else:
+            self.has_prev, self.has_next = more, known
+            rows.reverse()
+        self.items = rows
+        self.prev_cursor = self._row_id(rows[0]) if rows else None
+        self.next_cursor = self._row_id(rows[-1]) if rows else None
+
+    def _cursor(self, query, row_id):
+        # Ключ ищется в той же выборке: в нем могут быть колонки присоединенных таблиц
+        row = query.with_entities(*self.columns).filter(self.model.id == int(row_id)).first()
+        if row is None or any(value is None for value in row):
+            return None
+        return tuple_(*row)
+
+    def _fetch(self, query, forward):
+        ascending = forward != self.descending
+        order = [column.asc() if ascending else column.desc() for column in self.columns]
+        return query.order_by(*order).limit(self.per_page + 1)
+
+    def _row_id(self, row):
+        # Строки бывают моделями, кортежами из add_columns() и строками из with_entities()
+        if isinstance(row, self.model):
+            return row.id
+        if isinstance(row[0], self.model):
+            return row[0].id
+        return row.id
+
+    def __iter__(self):
+        if 'items' in self.__dict__:
+            return iter(self.items)
+        return self._stream()
+
+    def __getattr__(self, name):
+        # Потоковая страница, к которой обратились до перебора строк
+        if name in ('items', 'has_prev', 'has_next', 'prev_cursor', 'next_cursor') and '_request' in self.__dict__:
+            session = self._own_session()
+            try:
+                self._load(session)
+            finally:
+                session.close()
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+
+class AsyncKeysetPage(KeysetPage):
+    """KeysetPage для AsyncSession (asgi_app.py).
+
+    query - конструкция select(); строки выбираются при await page.load(session),
+    до этого к флагам и курсорам страницы обращаться нельзя.
+    """
+
+    def __init__(self, query, model, per_page, **kwargs):
+        super().__init__(query, model, per_page, stream=True, **kwargs)
+
+    async def load(self, session):
+        query, after, before, start, last = self._request
+        forward, known = not last, False
+        if after is not None and (cursor := await self._async_cursor(session, query, after)) is not None:
+            query, forward, known = query.where(self._after(cursor)), True, True
+        elif before is not None and (cursor := await self._async_cursor(session, query, before)) is not None:
+            query, forward, known = query.where(self._before(cursor)), False, True
+        elif start is not None and (cursor := await self._async_cursor(session, query, start)) is not None:
+            previous = await session.execute(query.where(self._before(cursor)).limit(1))
+            known = previous.first() is not None
+            query, forward = query.where(self._after(cursor, inclusive=True)), True
+        result = await session.execute(self._fetch(query, forward))
+        # select(Модель) отдает модели, как Model.query; выборка колонок - строки
+        description = query.column_descriptions
+        if len(description) == 1 and description[0]['expr'] is description[0]['entity']:
+            result = result.scalars()
+        rows = result.all()
+        self._finish(rows[:self.per_page], len(rows) > self.per_page, forward, known)
+        return self
+
+    async def _async_cursor(self, session, query, row_id):
+        result = await session.execute(query.with_only_columns(*self.columns)
+                                       .where(self.model.id == int(row_id)).limit(1))
+        row = result.first()
+        if row is None or any(value is None for value in row):
+            return None
+        return tuple_(*row)
+
+
+def page_args(args):
+    """Аргументы KeysetPage из параметров запроса"""
+    return dict(after=args.get('after', type=int),
+                before=args.get('before', type=int),
+                last=args.get('page') == 'last')
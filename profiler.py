@@ -0,0 +1,227 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import Response, g, request, request_started, request_tearing_down
+
+from config import CONFIG
+
+SORTS = ('cumulative', 'tottime', 'ncalls')
+
+
+class Profiler:
+    """Профилирование отдельных запросов.
+
+    Администратор добавляет к адресу ?_profile=1 и вместо страницы получает
+    отчет cProfile, отсортированный по cumulative (или по ?_sort=tottime /
+    ncalls), а с ?_profile=collapsed - стеки в свернутом формате для
+    flamegraph.pl или speedscope. Стеки явного профиля точные: каждый вызов
+    отслеживается через sys.setprofile, вес стека - его собственное время в
+    микросекундах. Потоковое тело ответа дочитывается внутри профиля, так что
+    в отчет попадает и рендеринг шаблона.
+
+    Кроме того, PROFILE_SAMPLE_RATE процентов обычных запросов снимаются
+    выборкой стеков (поток раз в PROFILE_INTERVAL_MS мс смотрит стек
+    обработчика, почти без накладных расходов) и сохраняются в
+    instance/<PROFILE_DIR>; там же остаются файлы .prof и .collapsed явных
+    профилей. Запрос короче интервала может не попасть ни в одну выборку,
+    тогда файл не пишется.
+    Хранятся последние PROFILE_KEEP файлов.
+
+    Кто администратор, решает функция, зарегистрированная через access().
+    """
+
+    def __init__(self, app=None):
+        self.enabled = CONFIG.PROFILER
+        self.sample_rate = CONFIG.PROFILE_SAMPLE_RATE
+        self.interval = CONFIG.PROFILE_INTERVAL_MS / 1000
+        self.directory = None
+        self._allowed = lambda: False
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not self.enabled:
+            return
+        self.directory = os.path.join(app.instance_path, CONFIG.PROFILE_DIR)
+        request_started.connect(self._start, app)
+        request_tearing_down.connect(self._finish, app)
+        app.after_request(self._report)
+
+    def access(self, function):
+        """Регистрирует функцию без аргументов: можно ли текущему пользователю профилировать"""
+        self._allowed = function
+        return function
+
+    # Запуск и остановка
+
+    def _start(self, sender, **extra):
+        mode = request.args.get('_profile')
+        if mode is not None:
+            if not self._allowed():
+                return
+            mode = 'collapsed' if mode == 'collapsed' else 'report'
+        elif self.sample_rate and random.random() * 100 < self.sample_rate:
+            mode = 'sample'
+        else:
+            return
+        if mode == 'report':
+            profile = cProfile.Profile()
+            profile.enable()
+        elif mode == 'collapsed':
+            profile = _CallStacks()
+            profile.start()
+        else:
+            profile = _StackSampler(threading.get_ident(), self.interval)
+            profile.start()
+        g.profile = (mode, profile, time.perf_counter())
+
+    def _stop(self):
+        mode, profile, started = g.pop('profile')
+        if mode == 'report':
+            profile.disable()
+        else:
+            profile.stop()
+        return mode, profile, time.perf_counter() - started
+
+    def _report(self, response):
+        if 'profile' not in g or g.profile[0] == 'sample':
+            return response
+        # Потоковое тело рендерится при чтении: читаем его здесь, пока профиль включен
+        response.get_data()
+        mode, profile, elapsed = self._stop()
+        title = f'{request.method} {request.full_path.rstrip("?")} -> {response.status_code}, {elapsed * 1000:.1f} мс'
+        g.pop('conditional', None)
+        if mode == 'report':
+            filename = self._save(profile, 'prof')
+            sort = request.args.get('_sort') if request.args.get('_sort') in SORTS else 'cumulative'
+            stream = io.StringIO()
+            pstats.Stats(profile, stream=stream).sort_stats(sort).print_stats(CONFIG.PROFILE_LIMIT)
+            report = Response(f'{title}\nФайл: {filename}\n{stream.getvalue()}', mimetype='text/plain')
+        else:
+            filename = self._save(profile, 'collapsed')
+            report = Response(profile.collapsed(), mimetype='text/plain', headers={
+                'Content-Disposition': f'attachment; filename="{os.path.basename(filename)}"'})
+        report.headers['Cache-Control'] = 'no-store'
+        report.headers['X-Profile-File'] = os.path.basename(filename)
+        return report
+
+    def _finish(self, sender, exc=None, **extra):
+        if 'profile' not in g:
+            return
+        mode, profile, elapsed = self._stop()
+        if mode == 'sample' and profile.stacks:
+            self._save(profile, 'collapsed')
+
+    # Файлы
+
+    def _save(self, profile, extension):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{request.endpoint or 'none'}.{extension}"
+        path = os.path.join(self.directory, name)
+        if extension == 'prof':
+            profile.dump_stats(path)
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(profile.collapsed())
+        self._cleanup()
+        return path
+
+    def _cleanup(self):
+        names = sorted(os.listdir(self.directory))
+        for name in names[:-CONFIG.PROFILE_KEEP]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+
+class _StackSampler:
+    """Выборка стека одного потока через равные промежутки времени"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='forum-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_function(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        """Стеки в формате flamegraph.pl: кадры через ';', затем число выборок"""
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self.stacks.items()))
+
+
+class _CallStacks:
+    """Точные стеки одного потока через sys.setprofile.
+
+    Время между соседними событиями вызова и возврата достается стеку,
+    который был на вершине, так что вес стека - собственное время его
+    последней функции в микросекундах.
+    """
+
+    def __init__(self):
+        self.stacks = Counter()
+        self._stack = []
+        self._last = 0
+
+    def start(self):
+        # Функции, которые уже выполняются, вернутся при включенном профиле: их надо знать заранее
+        frame = sys._getframe()
+        while frame is not None:
+            self._stack.append(_function(frame.f_code))
+            frame = frame.f_back
+        self._stack.reverse()
+        self._last = time.perf_counter_ns()
+        sys.setprofile(self._event)
+
+    def stop(self):
+        sys.setprofile(None)
+        self._charge()
+
+    def _event(self, frame, event, arg):
+        self._charge()
+        if event == 'call':
+            self._stack.append(_function(frame.f_code))
+        elif event == 'c_call':
+            self._stack.append(f"{getattr(arg, '__qualname__', repr(arg))} (builtin)")
+        elif self._stack:
+            # return, c_return, c_exception
+            self._stack.pop()
+
+    def _charge(self):
+        now = time.perf_counter_ns()
+        if self._stack:
+            self.stacks[';'.join(self._stack)] += (now - self._last) // 1000
+        self._last = now
+
+    def collapsed(self):
+        """Стеки в формате flamegraph.pl: кадры через ';', затем микросекунды"""
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self.stacks.items()) if count)
+
+
+def _function(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
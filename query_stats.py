@@ -0,0 +1,95 @@
+import logging
+import re
+import time
+from collections import Counter
+
+from flask import current_app, g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+
+from bd_app3 import db
+from config import CONFIG
+
+
+def statement_shape(statement):
+    """Нормализованный вид запроса: без лишних пробелов, IN (?, ?, ...) сворачивается в IN (?)"""
+    statement = ' '.join(statement.split())
+    return re.sub(r'IN \((?:\?|__\[POSTCOMPILE_\w+\])(?:, ?\?)*\)', 'IN (?)', statement)
+
+
+class QueryCounter:
+    """Счетчик SQL-запросов и поиск N+1 для каждого запроса к сайту.
+
+    Работает, когда приложение запущено в debug-режиме или задан FORUM_SQL_DEBUG=1.
+    Итог пишется в заголовки X-DB-Queries / X-DB-Time и в лог,
+    повторы одного и того же запроса выше порога - предупреждением о N+1.
+    """
+
+    def __init__(self, app=None):
+        self.threshold = CONFIG.SQL_N_PLUS_ONE_THRESHOLD
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(db.engine, 'after_cursor_execute', self._after_cursor_execute)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_finished, app)
+        if CONFIG.SQL_DEBUG:
+            app.logger.setLevel(logging.INFO)
+
+    def _enabled(self, app):
+        return app.debug or CONFIG.SQL_DEBUG
+
+    def _stats(self):
+        if not has_request_context():
+            return None
+        return g.get('sql_stats')
+
+    def _start(self):
+        if self._enabled(current_app):
+            g.sql_stats = {'count': 0, 'time': 0.0, 'shapes': Counter(), 'templates': {}}
+            g.sql_templates = []
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self._stats() is not None:
+            conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        stats = self._stats()
+        if stats is None or not conn.info.get('query_start'):
+            return
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        shape = statement_shape(statement)
+        stats['count'] += 1
+        stats['time'] += elapsed
+        stats['shapes'][shape] += 1
+        # Запомним, из какого шаблона пришел запрос (ленивые загрузки внутри шаблонов)
+        if g.sql_templates:
+            stats['templates'].setdefault(shape, g.sql_templates[-1])
+
+    def _template_started(self, sender, template, context, **extra):
+        if self._stats() is not None:
+            g.sql_templates.append(template.name)
+
+    def _template_finished(self, sender, template, context, **extra):
+        if self._stats() is not None and g.sql_templates:
+            g.sql_templates.pop()
+
+    def _finish(self, response):
+        stats = self._stats()
+        if stats is None:
+            return response
+        response.headers['X-DB-Queries'] = str(stats['count'])
+        response.headers['X-DB-Time'] = f"{stats['time'] * 1000:.2f}ms"
+        current_app.logger.info('%s %s: %d SQL-запросов, %.2f мс',
+                                request.method, request.full_path.rstrip('?'),
+                                stats['count'], stats['time'] * 1000)
+        for shape, count in stats['shapes'].most_common():
+            if count < self.threshold:
+                break
+            current_app.logger.warning('Возможный N+1: %s (шаблон %s) выполнил %d раз: %s',
+                                       request.endpoint, stats['templates'].get(shape, '-'), count, shape)
+        return response
@@ -0,0 +1,133 @@
+import re
+from markupsafe import Markup, escape
+from sqlalchemy import bindparam, text
+from bd_app3 import db
+
+# Служебные символы вместо тегов: текст сообщений экранируется,
+# а подсветка подставляется уже после экранирования
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+
+def build_match(query):
+    """Превращает ввод пользователя в безопасное выражение FTS5.
+
+    Каждое слово берется в кавычки (никакого синтаксиса FTS5 от пользователя),
+    слова объединяются через AND, последнее ищется по префиксу.
+    """
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+    terms = ['"' + word.replace('"', '""') + '"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def highlight(value):
+    """Экранирует фрагмент и превращает служебные символы в <mark>"""
+    value = str(escape(value or ''))
+    return Markup(value.replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+
+def search(query, category_id=None, author=None, page=1, per_page=20, max_pages=10, candidates=5000):
+    """Поиск по темам и сообщениям.
+
+    Возвращает (results, has_next). Цена запроса не зависит от размера базы:
+    - из каждой FTS-таблицы берутся candidates самых новых совпадений (FTS5
+      отдает их в порядке rowid без сортировки), и bm25 считается только для
+      них, а не для всех совпадений;
+    - кандидаты ранжируются по bm25 каждый в своей таблице (заголовок темы
+      весит в 10 раз больше текста) и обрезаются до max_pages страниц;
+    - оценки bm25 разных таблиц несравнимы, поэтому выдачи сливаются по месту
+      в своей таблице: первая тема, первое сообщение, вторая тема, ...;
+    - подсветка и фрагменты строятся только для строк страницы.
+    Глубже max_pages страниц результатов нет.
+    """
+    match = build_match(query)
+    if match is None or page > max_pages:
+        return [], False
+
+    filters = ''
+    params = {'match': match, 'candidates': candidates, 'depth': per_page * max_pages,
+              'limit': per_page + 1, 'offset': (page - 1) * per_page}
+    if category_id:
+        filters += ' AND t.category_id = :category_id'
+        params['category_id'] = category_id
+    if author:
+        filters += ' AND u.username = :author'
+        params['author'] = author
+    # Соединения нужны только для фильтров, без них кандидатов отдает одна FTS-таблица
+    topic_joins = 'JOIN topics t ON t.id = search_topics.rowid JOIN users u ON u.id = t.user_id' if filters else ''
+    post_joins = ('JOIN posts p ON p.id = search_posts.rowid JOIN topics t ON t.id = p.topic_id '
+                  'JOIN users u ON u.id = p.user_id') if filters else ''
+
+    sql = f"""
+        WITH topic_hits AS (
+            SELECT id, ROW_NUMBER() OVER (ORDER BY rank) AS position FROM (
+                SELECT search_topics.rowid AS id, search_topics.rank AS rank
+                FROM search_topics {topic_joins}
+                WHERE search_topics MATCH :match AND search_topics.rank MATCH 'bm25(10.0, 1.0)'{filters}
+                ORDER BY search_topics.rowid DESC
+                LIMIT :candidates)
+            ORDER BY rank
+            LIMIT :depth
+        ), post_hits AS (
+            SELECT id, ROW_NUMBER() OVER (ORDER BY rank) AS position FROM (
+                SELECT search_posts.rowid AS id, search_posts.rank AS rank
+                FROM search_posts {post_joins}
+                WHERE search_posts MATCH :match{filters}
+                ORDER BY search_posts.rowid DESC
+                LIMIT :candidates)
+            ORDER BY rank
+            LIMIT :depth
+        )
+        SELECT 'topic' AS kind, id, position FROM topic_hits
+        UNION ALL
+        SELECT 'post' AS kind, id, position FROM post_hits
+        ORDER BY position, kind DESC
+        LIMIT :limit OFFSET :offset
+    """
+    hits = db.session.execute(text(sql), params).all()
+    page_hits = hits[:per_page]
+    details = {}
+    for kind, sql in (('topic', TOPIC_DETAILS), ('post', POST_DETAILS)):
+        ids = [hit.id for hit in page_hits if hit.kind == kind]
+        if ids:
+            details.update(_details(kind, sql, ids, match))
+    results = [details[hit.kind, hit.id] for hit in page_hits if (hit.kind, hit.id) in details]
+    return results, len(hits) > per_page and page < max_pages
+
+
+# Строки страницы: одно чтение FTS-индекса по диапазону rowid страницы.
+# +rowid IN не передается в FTS5 как ограничение, иначе каждый id - отдельный поиск
+TOPIC_DETAILS = """
+    SELECT t.id AS id, 'topic' AS kind, t.id AS topic_id, NULL AS post_id,
+           highlight(search_topics, 0, :start, :end) AS title,
+           snippet(search_topics, 1, :start, :end, '…', 24) AS snippet,
+           u.username AS username, t.created_at AS created_at
+    FROM search_topics
+    JOIN topics t ON t.id = search_topics.rowid
+    JOIN users u ON u.id = t.user_id
+    WHERE search_topics MATCH :match AND search_topics.rowid BETWEEN :low AND :high
+      AND +search_topics.rowid IN :ids
+"""
+
+POST_DETAILS = """
+    SELECT p.id AS id, 'post' AS kind, t.id AS topic_id, p.id AS post_id,
+           t.title AS title,
+           snippet(search_posts, 0, :start, :end, '…', 24) AS snippet,
+           u.username AS username, p.created_at AS created_at
+    FROM search_posts
+    JOIN posts p ON p.id = search_posts.rowid
+    JOIN topics t ON t.id = p.topic_id
+    JOIN users u ON u.id = p.user_id
+    WHERE search_posts MATCH :match AND search_posts.rowid BETWEEN :low AND :high
+      AND +search_posts.rowid IN :ids
+"""
+
+
+def _details(kind, sql, ids, match):
+    params = {'match': match, 'start': MARK_START, 'end': MARK_END, 'ids': ids, 'low': min(ids), 'high': max(ids)}
+    rows = db.session.execute(text(sql).bindparams(bindparam('ids', expanding=True)), params).mappings()
+    return {(kind, row['id']): dict(row, title=highlight(row['title']), snippet=highlight(row['snippet']))
+            for row in rows}
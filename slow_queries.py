@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+from bd_app3 import db
+from config import CONFIG
+from query_stats import statement_shape
+
+# Служебные команды нет смысла объяснять
+NO_EXPLAIN = ('PRAGMA', 'BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'EXPLAIN', 'CREATE', 'DROP', 'ALTER')
+
+
+class SlowQueryLog:
+    """Журнал медленных SQL-запросов.
+
+    Каждый запрос дольше SLOW_QUERY_MS записывается одной JSON-строкой в
+    instance/<SLOW_QUERY_LOG> (с ротацией): текст, параметры, маршрут, время
+    и план из EXPLAIN QUERY PLAN. top() сводит журнал по нормализованному
+    виду запроса для страницы /admin/slow-queries.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = CONFIG.SLOW_QUERY_LOG_ENABLED
+        self.threshold = CONFIG.SLOW_QUERY_MS / 1000
+        self.path = None
+        self.logger = logging.getLogger('forum.slow_queries')
+        self.logger.propagate = False
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not self.enabled:
+            return
+        self.app = app
+        os.makedirs(app.instance_path, exist_ok=True)
+        self.path = os.path.join(app.instance_path, CONFIG.SLOW_QUERY_LOG)
+        if not self.logger.handlers:
+            handler = RotatingFileHandler(self.path, maxBytes=CONFIG.SLOW_QUERY_LOG_MAX_BYTES,
+                                          backupCount=CONFIG.SLOW_QUERY_LOG_BACKUPS, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.logger.addHandler(handler)
+            self.logger.setLevel(logging.INFO)
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(db.engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('slow_query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not conn.info.get('slow_query_start'):
+            return
+        elapsed = time.perf_counter() - conn.info['slow_query_start'].pop()
+        if elapsed < self.threshold:
+            return
+        if executemany and parameters:
+            parameters = parameters[0]
+        entry = {
+            'time': datetime.now().isoformat(timespec='milliseconds'),
+            'duration_ms': round(elapsed * 1000, 2),
+            'shape': statement_shape(statement),
+            'statement': statement,
+            'parameters': _safe_parameters(statement, parameters),
+            'executemany': executemany,
+            'route': None,
+            'plan': self._explain(cursor, statement, parameters),
+        }
+        if has_request_context():
+            entry['route'] = request.endpoint
+            entry['url'] = f'{request.method} {request.full_path.rstrip("?")}'
+        self.logger.info(json.dumps(entry, ensure_ascii=False, default=str))
+        self.app.logger.warning('Медленный запрос (%.1f мс, %s): %s',
+                                entry['duration_ms'], entry['route'] or '-', entry['shape'][:200])
+
+    def _explain(self, cursor, statement, parameters):
+        if statement.lstrip().upper().startswith(NO_EXPLAIN):
+            return []
+        # Отдельный курсор того же DBAPI-соединения: курсор запроса может быть еще не дочитан,
+        # а мимо событий SQLAlchemy EXPLAIN не попадает ни в метрики, ни обратно в этот журнал
+        try:
+            rows = cursor.connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters or ()).fetchall()
+            return [row[-1] for row in rows]
+        except Exception as error:
+            return [f'EXPLAIN не удался: {error}']
+
+    def entries(self):
+        """Записи журнала, начиная с самых старых файлов ротации"""
+        if self.path is None:
+            return
+        paths = [f'{self.path}.{number}' for number in range(CONFIG.SLOW_QUERY_LOG_BACKUPS, 0, -1)]
+        for path in paths + [self.path]:
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+
+    def top(self, limit=20):
+        """Самые дорогие виды запросов по суммарному времени"""
+        groups = {}
+        for entry in self.entries():
+            group = groups.get(entry['shape'])
+            if group is None:
+                group = groups[entry['shape']] = {
+                    'shape': entry['shape'], 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'routes': {}, 'slowest': entry, 'last_seen': entry['time'],
+                }
+            group['count'] += 1
+            group['total_ms'] += entry['duration_ms']
+            group['last_seen'] = entry['time']
+            route = entry.get('route') or '-'
+            group['routes'][route] = group['routes'].get(route, 0) + 1
+            if entry['duration_ms'] >= group['max_ms']:
+                group['max_ms'] = entry['duration_ms']
+                group['slowest'] = entry
+        result = sorted(groups.values(), key=lambda group: group['total_ms'], reverse=True)[:limit]
+        for group in result:
+            group['avg_ms'] = round(group['total_ms'] / group['count'], 2)
+            group['total_ms'] = round(group['total_ms'], 2)
+            group['routes'] = sorted(group['routes'].items(), key=lambda item: item[1], reverse=True)
+        return result
+
+
+_PASSWORD = re.compile(r'\bpassword\b', re.IGNORECASE)
+
+
+def _safe_parameters(statement, parameters):
+    # Пароли в этой базе хранятся как есть: параметры любого запроса, где
+    # упоминается колонка password (вход, регистрация, смена пароля), в журнал не попадают
+    if _PASSWORD.search(statement):
+        return '<скрыто>'
+    if isinstance(parameters, dict):
+        return {name: _short(value) for name, value in parameters.items()}
+    return [_short(value) for value in parameters or ()]
+
+
+def _short(value):
+    if isinstance(value, (bytes, str)) and len(value) > 200:
+        return value[:200] + '…'
+    return value
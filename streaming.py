@@ -0,0 +1,80 @@
+from flask import Response, g, get_flashed_messages, render_template, stream_template
+
+from config import CONFIG
+
+
+def stream_page(template_name, **context):
+    """render_template, который отдает страницу по частям по мере рендеринга.
+
+    Шаблон рендерится, пока клиент читает ответ, поэтому шапка страницы уходит
+    до того, как выполнены запросы, которые шаблон делает в цикле (выборки с
+    yield_per читаются из курсора построчно). Мелкие куски Jinja склеиваются
+    до STREAM_BUFFER_SIZE байт, чтобы не отправлять и не сжимать по строке.
+    """
+    # Заголовки (и cookie сессии) уходят до рендеринга, поэтому флэш-сообщения
+    # надо забрать из сессии сейчас; шаблон получит их из кэша запроса
+    get_flashed_messages()
+    if 'page_cache' in g:
+        # Эту страницу целиком сохранит кэш гостевых страниц, потоком ее не отдать
+        return render_template(template_name, **context)
+    chunks = stream_template(template_name, **context)
+    return Response(_buffered(chunks, CONFIG.STREAM_BUFFER_SIZE), mimetype='text/html')
+
+
+def _buffered(chunks, size):
+    buffer = []
+    length = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+class ClosingBody:
+    """Тело ответа, которое ровно один раз вызывает callback(error), когда
+    отдача закончена: тело дочитано, упало с ошибкой или закрыто сервером.
+
+    Генератор с finally для этого не годится: на HEAD-запрос или при обрыве
+    соединения сервер закрывает тело, не начав его читать, а close()
+    незапущенного генератора finally не выполняет. close() этого объекта
+    Werkzeug вызывает всегда, через Response.close().
+    """
+
+    def __init__(self, chunks, callback):
+        self.chunks = chunks
+        self.callback = callback
+        self._iterator = None
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._iterator is None:
+            self._iterator = iter(self.chunks)
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            self._finish(None)
+            raise
+        except BaseException as error:
+            self._finish(error)
+            raise
+
+    def close(self):
+        try:
+            close = getattr(self.chunks, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self._finish(None)
+
+    def _finish(self, error):
+        if not self._done:
+            self._done = True
+            self.callback(error)
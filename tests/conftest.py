@@ -0,0 +1,41 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+# CONFIG читается при импорте, поэтому база и настройки задаются до импорта приложения
+DB_DIR = tempfile.mkdtemp(prefix='forum-tests-')
+os.environ['FORUM_DATABASE_URI'] = f'sqlite:///{os.path.join(DB_DIR, "forum.db")}'
+os.environ['FORUM_JOBS'] = '0'
+os.environ['FORUM_PROFILE_DIR'] = os.path.join(DB_DIR, 'profiles')
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app3 import app
+    from bd_app3 import User
+    from seed_data import seed
+    with app.app_context():
+        if User.query.first() is None:
+            seed(1_000)
+    return app
+
+
+@pytest.fixture(scope='session')
+def pool(app):
+    from bd_app3 import db
+    with app.app_context():
+        return db.engine.pool
+
+
+@pytest.fixture
+def admin_client(app):
+    from seed_data import ADMIN
+    client = app.test_client()
+    client.post('/login', data={'form_type': 'login', **ADMIN})
+    return client
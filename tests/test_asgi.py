@@ -0,0 +1,118 @@
+import asyncio
+import gzip
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def asgi(app):
+    import asgi_app
+    loop = asyncio.new_event_loop()
+    yield asgi_app, lambda *args, **kwargs: loop.run_until_complete(call(asgi_app.application, *args, **kwargs))
+    loop.run_until_complete(asgi_app.engine.dispose())
+    loop.close()
+
+
+async def call(application, url, method='GET', headers=None):
+    """Один запрос к ASGI-приложению: (статус, заголовки, тело)"""
+    path, _, query = url.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+        'root_path': '', 'client': ('127.0.0.1', 50000), 'server': ('localhost', 80),
+        'headers': [(b'host', b'localhost')] + [(name.lower().encode(), value.encode())
+                                                for name, value in (headers or {}).items()],
+    }
+    received = []
+    messages = []
+
+    async def receive():
+        if not received:
+            received.append(True)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Клиент не отключается, пока ответ не отправлен
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    start = messages[0]
+    headers = {name.decode().lower(): value.decode() for name, value in start['headers']}
+    return start['status'], headers, b''.join(message.get('body', b'') for message in messages[1:])
+
+
+ASYNC_PAGES = ['/', '/about', '/category/1', '/category/1?page=last', '/topic/1', '/topic/1?page=last',
+               '/profile/admin']
+
+
+@pytest.mark.parametrize('url', ASYNC_PAGES)
+def test_async_pages(asgi, url):
+    asgi_app, request = asgi
+    assert asgi_app.application._is_async({'method': 'GET', 'path': url.partition('?')[0]})
+    status, headers, body = request(url)
+    assert status == 200
+    assert headers['content-type'].startswith('text/html')
+    assert b'</html>' in body
+
+
+@pytest.mark.parametrize('url', ['/topic/999999', '/category/999999'])
+def test_missing_pages(asgi, url):
+    asgi_app, request = asgi
+    assert request(url)[0] == 404
+
+
+@pytest.mark.parametrize('method, path', [
+    ('POST', '/topic/1'), ('GET', '/login'), ('GET', '/admin'), ('GET', '/metrics'), ('GET', '/static/style.css'),
+])
+def test_other_requests_go_to_sync_app(asgi, method, path):
+    asgi_app, request = asgi
+    assert not asgi_app.application._is_async({'method': method, 'path': path})
+
+
+def test_sync_app_behind_dispatcher(asgi):
+    asgi_app, request = asgi
+    status, headers, body = request('/login')
+    assert status == 200
+    assert 'form_type' in body.decode()
+
+
+def test_links_to_sync_routes(asgi):
+    asgi_app, request = asgi
+
+    async def build():
+        async with asgi_app.async_app.test_request_context('/'):
+            return asgi_app.url_for('login'), asgi_app.url_for('admin_jobs')
+
+    assert asyncio.new_event_loop().run_until_complete(build()) == ('/login', '/admin/jobs')
+
+
+def test_async_pages_are_conditional_and_compressed(asgi):
+    asgi_app, request = asgi
+    status, headers, body = request('/topic/1', headers={'Accept-Encoding': 'gzip'})
+    assert status == 200
+    assert headers['content-encoding'] == 'gzip'
+    assert b'</html>' in gzip.decompress(body)
+    status, _, body = request('/topic/1', headers={'If-None-Match': headers['etag']})
+    assert status == 304
+    assert body == b''
+
+
+def test_async_keyset_page_matches_sync(asgi, app):
+    asgi_app, request = asgi
+    from sqlalchemy import select
+    from bd_app3 import Post
+    from pagination import AsyncKeysetPage, KeysetPage
+
+    async def load(**kwargs):
+        async with asgi_app.read_session() as db_session:
+            page = await AsyncKeysetPage(select(Post).where(Post.topic_id == 1), Post, 20, **kwargs).load(db_session)
+            return [post.id for post in page], page.has_next, page.has_prev
+
+    loop = asyncio.new_event_loop()
+    with app.app_context():
+        for kwargs in ({}, {'last': True}):
+            page = KeysetPage(Post.query.filter(Post.topic_id == 1), Post, 20, **kwargs)
+            expected = ([post.id for post in page], page.has_next, page.has_prev)
+            assert loop.run_until_complete(load(**kwargs)) == expected
+    loop.close()
@@ -0,0 +1,44 @@
+import pytest
+
+from compression import Compression
+
+
+class Body:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = 0
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed += 1
+
+
+def wrap(body, mimetype):
+    def application(environ, start_response):
+        start_response('200 OK', [('Content-Type', mimetype)])
+        return body
+    compression = Compression()
+    compression.enabled = True
+    compression.wsgi_app = application
+    return compression
+
+
+@pytest.mark.parametrize('mimetype', ['text/html', 'application/octet-stream'])
+def test_body_closed_when_response_closed_unread(mimetype):
+    # Так поступает сервер на HEAD или при обрыве соединения
+    body = Body([b'x' * 4096, b'y' * 4096])
+    response = wrap(body, mimetype)({'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip'},
+                                    lambda status, headers, exc_info=None: None)
+    response.close()
+    assert body.closed == 1
+
+
+def test_body_closed_once_after_streaming():
+    body = Body([b'x' * 4096, b'y' * 4096])
+    response = wrap(body, 'text/html')({'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip'},
+                                       lambda status, headers, exc_info=None: None)
+    assert b''.join(response)
+    response.close()
+    assert body.closed == 1
@@ -0,0 +1,25 @@
+import pytest
+
+
+def get(client, url, **headers):
+    response = client.get(url, headers=headers)
+    response.get_data()
+    response.close()
+    return response
+
+
+@pytest.mark.parametrize('url', ['/topic/1', '/category/1', '/profile/admin'])
+def test_if_modified_since_alone_is_not_trusted(admin_client, url):
+    get(admin_client, '/')     # забирает флэш-сообщение о входе
+    response = get(admin_client, url)
+    assert response.status_code == 200
+    assert 'Last-Modified' not in response.headers
+    # Удаление записи не сдвигает время последней записи, поэтому без ETag - всегда полная страница
+    response = get(admin_client, url, **{'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+    assert response.status_code == 200
+
+
+def test_etag_gives_not_modified(admin_client):
+    get(admin_client, '/')
+    etag = get(admin_client, '/topic/1').headers['ETag']
+    assert get(admin_client, '/topic/1', **{'If-None-Match': etag}).status_code == 304
@@ -0,0 +1,35 @@
+import os
+
+from jobs import JobRunner
+
+
+def make_runner(app, tmp_path):
+    runner = JobRunner(app)
+    runner.enabled = True
+    runner.heartbeat = str(tmp_path / 'jobs.heartbeat')
+    runner.task('double')(lambda value: value * 2)
+    return runner
+
+
+def test_runs_inline_without_workers(app, tmp_path):
+    from bd_app3 import db, Job
+    runner = make_runner(app, tmp_path)
+    with app.app_context():
+        assert not runner.alive()
+        job = db.session.get(Job, runner.enqueue('double', value=21))
+        assert (job.status, job.result) == ('done', '42')
+
+
+def test_queues_while_workers_are_alive(app, tmp_path):
+    from bd_app3 import db, Job
+    runner = make_runner(app, tmp_path)
+    # Отметку обновляет процесс с исполнителями, например flask jobs-worker
+    open(runner.heartbeat, 'w').close()
+    with app.app_context():
+        assert runner.alive()
+        job = db.session.get(Job, runner.enqueue('double', value=21))
+        assert job.status == 'queued'
+        db.session.delete(job)
+        db.session.commit()
+    os.utime(runner.heartbeat, (0, 0))
+    assert not runner.alive()
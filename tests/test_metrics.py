@@ -0,0 +1,35 @@
+import re
+
+
+def in_flight(client):
+    return int(re.search(r'^forum_http_requests_in_flight (-?\d+)$', client.get('/metrics').text, re.M).group(1))
+
+
+def test_streamed_requests_finish(admin_client):
+    before = in_flight(admin_client)
+    admin_client.get('/topic/1').close()
+    for _ in range(3):
+        admin_client.head('/topic/1').close()
+    # Сам запрос /metrics еще в работе, пока рендерится ответ
+    assert in_flight(admin_client) == before
+
+
+def test_metrics_without_token_are_local_only(app):
+    client = app.test_client()
+    assert client.get('/metrics').status_code == 200
+    assert client.get('/metrics', environ_base={'REMOTE_ADDR': '10.0.0.5'}).status_code == 403
+    # За прокси на той же машине remote_addr локальный, но клиент - нет
+    assert client.get('/metrics', headers={'X-Forwarded-For': '10.0.0.5'}).status_code == 403
+
+
+def test_metrics_token(app, monkeypatch):
+    from app3 import metrics
+    monkeypatch.setattr(metrics, 'token', 'secret')
+    client = app.test_client()
+    response = client.get('/metrics')
+    assert response.status_code == 401
+    assert response.headers['WWW-Authenticate'].startswith('Bearer')
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer secret'},
+                          environ_base={'REMOTE_ADDR': '10.0.0.5'})
+    assert response.status_code == 200
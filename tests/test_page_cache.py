@@ -0,0 +1,65 @@
+from bd_app3 import db, User
+
+
+def cache_status(app, url):
+    response = app.test_client().get(url)
+    response.close()
+    return response.headers.get('X-Page-Cache')
+
+
+def test_user_changes_flush_only_pages_that_show_them(app):
+    cache_status(app, '/topic/1')
+    assert cache_status(app, '/topic/1') == 'HIT'
+
+    with app.app_context():
+        user = User(username='cache_test', email='cache_test@example.com', password='x')
+        db.session.add(user)
+        db.session.commit()
+        assert cache_status(app, '/topic/1') == 'HIT'
+
+        user.email = 'cache_test2@example.com'
+        db.session.commit()
+        assert cache_status(app, '/topic/1') == 'HIT'
+
+        user.username = 'cache_test2'
+        db.session.commit()
+        assert cache_status(app, '/topic/1') == 'MISS'
+
+        db.session.delete(user)
+        db.session.commit()
+
+
+def test_author_post_elsewhere_flushes_topic_with_their_counter(app):
+    from bd_app3 import Post
+    with app.app_context():
+        authors = {user_id for (user_id,) in db.session.query(Post.user_id).filter(Post.topic_id == 1)}
+        other = db.session.query(Post.topic_id).filter(Post.topic_id != 1).first()[0]
+        author = db.session.get(User, min(authors))
+        outsider = User(username='cache_outsider', email='cache_outsider@example.com', password='x')
+        db.session.add(outsider)
+        db.session.commit()
+
+        cache_status(app, '/topic/1')
+        assert cache_status(app, '/topic/1') == 'HIT'
+
+        post = Post(content='чужая тема', user_id=outsider.id, topic_id=other)
+        db.session.add(post)
+        db.session.commit()
+        assert cache_status(app, '/topic/1') == 'HIT'
+        db.session.delete(post)
+        db.session.commit()
+        assert cache_status(app, '/topic/1') == 'HIT'
+
+        count = author.post_count
+        post = Post(content='другая тема', user_id=author.id, topic_id=other)
+        db.session.add(post)
+        db.session.commit()
+        response = app.test_client().get('/topic/1')
+        assert response.headers['X-Page-Cache'] == 'MISS'
+        assert f'{count + 1} сообщ.' in response.get_data(as_text=True)
+
+        db.session.delete(post)
+        db.session.commit()
+        assert cache_status(app, '/topic/1') == 'MISS'
+        db.session.delete(outsider)
+        db.session.commit()
@@ -0,0 +1,7 @@
+def test_collapsed_profile_of_fast_request(admin_client):
+    response = admin_client.get('/about?_profile=collapsed')
+    lines = response.text.splitlines()
+    assert response.status_code == 200
+    assert lines
+    assert all(int(line.rsplit(' ', 1)[1]) > 0 for line in lines)
+    assert any('about (app3.py:' in line for line in lines)
@@ -0,0 +1,32 @@
+from search import search
+
+
+def test_topics_and_posts_are_merged_by_position(app):
+    with app.app_context():
+        results, has_next = search('sqlite', per_page=6)
+    assert [result['kind'] for result in results] == ['topic', 'post'] * 3
+    assert has_next
+    assert all('<mark>' in str(result['snippet']) for result in results)
+
+
+def test_depth_is_capped(app):
+    with app.app_context():
+        last, has_next = search('sqlite', page=3, per_page=5, max_pages=3)
+        beyond = search('sqlite', page=4, per_page=5, max_pages=3)
+    assert len(last) == 5
+    assert not has_next
+    assert beyond == ([], False)
+
+
+def test_filters(app):
+    from bd_app3 import Topic
+    with app.app_context():
+        results, _ = search('sqlite', category_id=1, per_page=50)
+        topics = {topic.id for topic in Topic.query.filter(Topic.category_id == 1)}
+    assert results
+    assert {result['topic_id'] for result in results} <= topics
+
+
+def test_empty_query(app):
+    with app.app_context():
+        assert search('  ,. ') == ([], False)
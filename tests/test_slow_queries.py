@@ -0,0 +1,17 @@
+import pytest
+
+from slow_queries import _safe_parameters
+
+
+@pytest.mark.parametrize('statement', [
+    'INSERT INTO users (username, email, password, created_at) VALUES (?, ?, ?, ?)',
+    'SELECT users.id FROM users WHERE users.username = ? AND users.password = ? LIMIT ? OFFSET ?',
+    'UPDATE users SET password=? WHERE users.id = ?',
+])
+def test_password_parameters_are_masked(statement):
+    assert _safe_parameters(statement, ('admin', 'admin@example.com', 'secret', '2026-01-01')) == '<скрыто>'
+
+
+def test_other_parameters_are_logged():
+    statement = 'SELECT posts.id FROM posts WHERE posts.topic_id = ? LIMIT ?'
+    assert _safe_parameters(statement, (1, 'x' * 300)) == [1, 'x' * 200 + '…']
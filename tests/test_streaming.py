@@ -0,0 +1,18 @@
+import pytest
+
+
+@pytest.mark.parametrize('url', [
+    '/admin/posts', '/admin/topics', '/admin/users', '/admin/posts?page=last',
+    '/topic/1', '/topic/1?page=last', '/admin/export/posts?format=csv',
+])
+def test_streamed_page_returns_connection(admin_client, pool, url):
+    response = admin_client.get(url)
+    assert response.status_code == 200
+    response.get_data()
+    response.close()
+    assert pool.checkedout() == 0
+
+
+def test_head_of_streamed_page_returns_connection(admin_client, pool):
+    admin_client.head('/topic/1').close()
+    assert pool.checkedout() == 0
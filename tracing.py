@@ -0,0 +1,254 @@
+import json
+import logging
+import os
+import random
+import re
+import time
+from logging.handlers import RotatingFileHandler
+
+from flask import g, has_request_context, request
+from flask import before_render_template, template_rendered, request_started, request_tearing_down
+from sqlalchemy import event
+
+from bd_app3 import db
+from config import CONFIG
+from query_stats import statement_shape
+from streaming import ClosingBody
+
+# Виды спанов OTLP
+SERVER, INTERNAL, CLIENT = 2, 1, 3
+# Статусы спанов OTLP
+STATUS_OK, STATUS_ERROR = 1, 2
+
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+"?(\w+)', re.IGNORECASE)
+
+
+class Tracer:
+    """Трассировка запросов: спаны обработчика, SQL, шаблонов и отдачи тела.
+
+    Каждый запрос получает trace id (из заголовка traceparent, если он есть,
+    иначе новый), он же уходит клиенту в X-Request-ID. Корневой спан - весь
+    запрос, внутри него спаны view (обработчик), render <шаблон>,
+    response.stream (отдача потокового тела) и по спану на SQL-запрос.
+    SQL-запрос получает родителем самый внутренний открытый спан, поэтому
+    ленивые загрузки из шаблона видны под спаном render.
+
+    Трасса пишется после запроса одной строкой в instance/<TRACE_LOG> в
+    формате OTLP/JSON (ExportTraceServiceRequest), который читает, например,
+    otlpjsonfile-приемник OpenTelemetry Collector. Записываются
+    TRACE_SAMPLE_RATE процентов запросов.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = CONFIG.TRACING
+        self.sample_rate = CONFIG.TRACE_SAMPLE_RATE
+        self.max_spans = CONFIG.TRACE_MAX_SPANS
+        self.path = None
+        self.logger = logging.getLogger('forum.tracing')
+        self.logger.propagate = False
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not self.enabled:
+            return
+        os.makedirs(app.instance_path, exist_ok=True)
+        self.path = os.path.join(app.instance_path, CONFIG.TRACE_LOG)
+        if not self.logger.handlers:
+            handler = RotatingFileHandler(self.path, maxBytes=CONFIG.TRACE_LOG_MAX_BYTES,
+                                          backupCount=CONFIG.TRACE_LOG_BACKUPS, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.logger.addHandler(handler)
+            self.logger.setLevel(logging.INFO)
+        request_started.connect(self._request_started, app)
+        request_tearing_down.connect(self._request_finished, app)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_finished, app)
+        app.before_request(self._view_started)
+        app.after_request(self._view_finished)
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._query_started)
+            event.listen(db.engine, 'after_cursor_execute', self._query_finished)
+
+    # Спаны
+
+    def _open(self, trace, name, kind, attributes=None):
+        if len(trace['spans']) >= self.max_spans:
+            trace['dropped'] += 1
+            return None
+        stack = trace['stack']
+        span = {
+            'traceId': trace['id'],
+            'spanId': os.urandom(8).hex(),
+            'parentSpanId': stack[-1]['spanId'] if stack else trace['parent'],
+            'name': name,
+            'kind': kind,
+            'start': time.time_ns(),
+            'end': None,
+            'attributes': attributes or {},
+            'status': None,
+        }
+        trace['spans'].append(span)
+        stack.append(span)
+        return span
+
+    def _close(self, trace, span, **attributes):
+        if span is None:
+            return
+        span['end'] = time.time_ns()
+        span['attributes'].update(attributes)
+        if span in trace['stack']:
+            trace['stack'].remove(span)
+
+    # Запрос
+
+    def _request_started(self, sender, **extra):
+        if self.sample_rate < 100 and random.random() * 100 >= self.sample_rate:
+            return
+        match = TRACEPARENT.match(request.headers.get('traceparent', ''))
+        trace_id, parent = match.groups() if match else (os.urandom(16).hex(), '')
+        g.trace = trace = {'id': trace_id, 'parent': parent, 'spans': [], 'stack': [], 'templates': [],
+                           'dropped': 0, 'view': None, 'streaming': False, 'exported': False}
+        route = request.url_rule.rule if request.url_rule else request.path
+        self._open(trace, f'{request.method} {route}', SERVER, {
+            'http.request.method': request.method,
+            'http.route': route,
+            'url.path': request.path,
+            'url.query': request.query_string.decode('latin-1'),
+            'forum.endpoint': request.endpoint or 'none',
+        })
+
+    def _view_started(self):
+        # Функции before_request трассировщика идут последними: дальше только обработчик
+        trace = g.get('trace')
+        if trace is not None:
+            trace['view'] = self._open(trace, 'view', INTERNAL, {'code.function': request.endpoint or 'none'})
+
+    def _view_finished(self, response):
+        trace = g.get('trace')
+        if trace is None:
+            return response
+        root = trace['spans'][0]
+        root['attributes']['http.response.status_code'] = response.status_code
+        response.headers['X-Request-ID'] = trace['id']
+        self._close(trace, trace['view'])
+        if response.is_streamed:
+            # Тело рендерится при отдаче, уже после teardown запроса:
+            # трасса закончится вместе с телом
+            stream = self._open(trace, 'response.stream', INTERNAL)
+            if stream is not None:
+                # Шаблон открыт еще в обработчике: отдача - дочерний спан корня, а в стеке ниже шаблона
+                stream['parentSpanId'] = root['spanId']
+                trace['stack'].remove(stream)
+                trace['stack'].insert(1, stream)
+            trace['streaming'] = True
+            response.response = ClosingBody(response.response, lambda error: self._export(trace, error))
+        return response
+
+    def _request_finished(self, sender, exc=None, **extra):
+        trace = g.get('trace')
+        if trace is not None and not trace['streaming']:
+            self._export(trace, exc)
+
+    def _export(self, trace, exc):
+        if trace['exported']:
+            return
+        trace['exported'] = True
+        for span in reversed(trace['stack']):
+            self._close(trace, span)
+        root = trace['spans'][0]
+        status = root['attributes'].get('http.response.status_code', 500 if exc is not None else 200)
+        if exc is not None or status >= 500:
+            root['status'] = {'code': STATUS_ERROR, 'message': repr(exc) if exc is not None else ''}
+        if trace['dropped']:
+            root['attributes']['forum.dropped_spans'] = trace['dropped']
+        self.logger.info(json.dumps(_export(trace['spans']), ensure_ascii=False, separators=(',', ':')))
+
+    # Шаблоны и SQL
+
+    def _active(self):
+        """Трасса текущего запроса, если она еще пишется"""
+        if not has_request_context():
+            return None
+        trace = g.get('trace')
+        return None if trace is None or trace['exported'] else trace
+
+    def _template_started(self, sender, template, context, **extra):
+        trace = self._active()
+        if trace is not None:
+            name = template.name or '-'
+            trace['templates'].append(self._open(trace, f'render {name}', INTERNAL, {'forum.template': name}))
+
+    def _template_finished(self, sender, template, context, **extra):
+        trace = self._active()
+        if trace is not None and trace['templates']:
+            self._close(trace, trace['templates'].pop())
+
+    def _query_started(self, conn, cursor, statement, parameters, context, executemany):
+        trace = self._active()
+        if trace is None:
+            return
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ''
+        table = TABLE.search(statement)
+        attributes = {
+            'db.system': 'sqlite',
+            'db.operation.name': operation,
+            'db.query.text': statement_shape(statement)[:CONFIG.TRACE_STATEMENT_LENGTH],
+        }
+        if table:
+            attributes['db.collection.name'] = table.group(1)
+        name = f'{operation} {table.group(1)}' if table else operation
+        conn.info.setdefault('trace_spans', []).append((trace, self._open(trace, name, CLIENT, attributes)))
+
+    def _query_finished(self, conn, cursor, statement, parameters, context, executemany):
+        if not conn.info.get('trace_spans'):
+            return
+        trace, span = conn.info['trace_spans'].pop()
+        rows = cursor.rowcount
+        if rows is not None and rows >= 0:
+            self._close(trace, span, **{'db.response.returned_rows': rows})
+        else:
+            self._close(trace, span)
+
+
+def _export(spans):
+    """Спаны в формате OTLP/JSON: id в hex, время в наносекундах строкой"""
+    return {'resourceSpans': [{
+        'resource': {'attributes': _attributes({'service.name': CONFIG.TRACE_SERVICE_NAME})},
+        'scopeSpans': [{
+            'scope': {'name': 'forum.tracing'},
+            'spans': [_span(span) for span in spans],
+        }],
+    }]}
+
+
+def _span(span):
+    result = {
+        'traceId': span['traceId'],
+        'spanId': span['spanId'],
+        'name': span['name'],
+        'kind': span['kind'],
+        'startTimeUnixNano': str(span['start']),
+        'endTimeUnixNano': str(span['end'] or span['start']),
+        'attributes': _attributes(span['attributes']),
+        'status': span['status'] or {'code': STATUS_OK},
+    }
+    if span['parentSpanId']:
+        result['parentSpanId'] = span['parentSpanId']
+    return result
+
+
+def _attributes(attributes):
+    result = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            value = {'boolValue': value}
+        elif isinstance(value, int):
+            value = {'intValue': str(value)}
+        elif isinstance(value, float):
+            value = {'doubleValue': value}
+        else:
+            value = {'stringValue': str(value)}
+        result.append({'key': key, 'value': value})
+    return result
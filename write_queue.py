@@ -0,0 +1,108 @@
+import queue
+import threading
+import time
+
+from bd_app3 import db
+from config import CONFIG
+
+
+class _PendingWrite:
+
+    def __init__(self, model, values):
+        self.model = model
+        self.values = values
+        self.id = None
+        self.error = None
+        self.done = threading.Event()
+
+    def finish(self, id=None, error=None):
+        self.id = id
+        self.error = error
+        self.done.set()
+
+
+class WriteQueue:
+    """Групповой коммит новых тем и сообщений.
+
+    Когда включен (FORUM_GROUP_COMMIT=1), запросы не коммитят сами, а передают
+    запись в единственный поток-писатель. Он собирает записи, пришедшие за
+    GROUP_COMMIT_MAX_DELAY_MS (но не больше GROUP_COMMIT_MAX_BATCH), и сохраняет
+    их одной транзакцией. Запрос ждет, пока его запись закоммитится, и получает
+    свой id или свою ошибку. Если пачка падает целиком, записи повторяются
+    по одной, чтобы ошибка досталась только тому запросу, который ее вызвал.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = CONFIG.GROUP_COMMIT
+        self.max_batch = CONFIG.GROUP_COMMIT_MAX_BATCH
+        self.max_delay = CONFIG.GROUP_COMMIT_MAX_DELAY_MS / 1000
+        self.timeout = CONFIG.GROUP_COMMIT_TIMEOUT
+        self._queue = queue.Queue()
+        self._thread = None
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        if self.enabled:
+            self._thread = threading.Thread(target=self._run, name='forum-write-queue', daemon=True)
+            self._thread.start()
+
+    def create(self, model, **values):
+        """Создает запись model(**values), коммитит ее и возвращает id"""
+        if not self.enabled:
+            obj = model(**values)
+            db.session.add(obj)
+            db.session.commit()
+            return obj.id
+        item = _PendingWrite(model, values)
+        self._queue.put(item)
+        if not item.done.wait(self.timeout):
+            raise TimeoutError('Запись не была сохранена вовремя')
+        if item.error is not None:
+            raise item.error
+        return item.id
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                batch = [self._queue.get()]
+                deadline = time.monotonic() + self.max_delay
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self._queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+                self._commit(batch)
+
+    def _commit(self, batch):
+        try:
+            objects = [item.model(**item.values) for item in batch]
+            db.session.add_all(objects)
+            db.session.flush()
+            ids = [obj.id for obj in objects]
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            for item in batch:
+                self._commit_one(item)
+        else:
+            for item, id in zip(batch, ids):
+                item.finish(id=id)
+        finally:
+            db.session.remove()
+
+    def _commit_one(self, item):
+        try:
+            obj = item.model(**item.values)
+            db.session.add(obj)
+            db.session.flush()
+            id = obj.id
+            db.session.commit()
+            item.finish(id=id)
+        except Exception as error:
+            db.session.rollback()
+            item.finish(error=error)